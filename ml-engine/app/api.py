@@ -3,17 +3,23 @@ Flask API for ML Engine
 Provides endpoints for clustering and sentiment analysis
 """
 import os
+import re
 import sys
+import json
 import time
 import math
+import gzip
 import logging
-from flask import Flask, jsonify, request
-from flasgger import Swagger
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from flask import Flask, Response, request
 from dotenv import load_dotenv
 
-from preprocessing import preprocess_posts
-from sentiment import analyze_posts_sentiment, aggregate_cluster_sentiment, classify_sentiment
-from clustering import cluster_posts
+# The ML pipeline modules (preprocessing, sentiment, clustering) pull in
+# nltk/sklearn/numpy and are imported on first use; wsgi.py imports them
+# eagerly so gunicorn's preloaded master shares them with its workers.
+from batching import MicroBatcher
+from cache import ContentCache
 
 load_dotenv()
 
@@ -60,12 +66,150 @@ swagger_template = {
     "schemes": ["http", "https"]
 }
 
-swagger = Swagger(app, config=swagger_config, template=swagger_template)
+# Swagger UI/spec routes are opt-in (ENABLE_SWAGGER=1) so production workers
+# skip flasgger's import, route registration and docstring introspection
+ENABLE_SWAGGER = os.environ.get('ENABLE_SWAGGER', '0') == '1'
+swagger = None
+if ENABLE_SWAGGER:
+    from flasgger import Swagger
+    swagger = Swagger(app, config=swagger_config, template=swagger_template)
 
 # Request size limits (configurable via environment)
 MAX_POSTS_PER_REQUEST = int(os.environ.get('MAX_POSTS_PER_REQUEST', '500'))
 MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', '10000'))
 
+# Response compression (gzip for JSON bodies when the client accepts it)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '5'))
+
+# Coalesce sentiment scoring across concurrent requests (per worker process).
+# A request arriving while no batch is running is scored immediately; only
+# requests that arrive during a running batch wait, up to the max latency,
+# to be scored together.
+SENTIMENT_BATCH_SIZE = int(os.environ.get('SENTIMENT_BATCH_SIZE', '256'))
+SENTIMENT_BATCH_MAX_LATENCY_MS = float(os.environ.get('SENTIMENT_BATCH_MAX_LATENCY_MS', '20'))
+
+def _score_sentiment_batch(posts: list) -> list:
+    """Batch function for the sentiment batcher"""
+    from sentiment import analyze_posts_sentiment
+    return analyze_posts_sentiment(posts)
+
+
+sentiment_batcher = MicroBatcher(
+    _score_sentiment_batch,
+    batch_size=SENTIMENT_BATCH_SIZE,
+    max_latency=SENTIMENT_BATCH_MAX_LATENCY_MS / 1000
+)
+
+# Per-content result caches (repeated retweets/boilerplate skip the pipeline)
+CONTENT_CACHE_SIZE = int(os.environ.get('CONTENT_CACHE_SIZE', '50000'))
+preprocess_cache = ContentCache(maxsize=CONTENT_CACHE_SIZE)
+sentiment_cache = ContentCache(maxsize=CONTENT_CACHE_SIZE)
+
+# Whole-response cache for /api/analyze keyed by a hash of the request body,
+# also exposed as an ETag. Bump ANALYSIS_CACHE_VERSION when the models change.
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '512'))
+ANALYSIS_CACHE_VERSION = os.environ.get('ANALYSIS_CACHE_VERSION', '1')
+response_cache = ContentCache(maxsize=RESPONSE_CACHE_SIZE)
+
+# Sentiment scoring runs alongside clustering within a request. Created lazily
+# so the pool is owned by each gunicorn worker rather than the preloading master.
+ANALYZE_STAGE_THREADS = int(os.environ.get('ANALYZE_STAGE_THREADS', '4'))
+_stage_executor = None
+
+
+def _get_stage_executor() -> ThreadPoolExecutor:
+    """Get or create the per-process executor for overlapping pipeline stages"""
+    global _stage_executor
+    if _stage_executor is None:
+        _stage_executor = ThreadPoolExecutor(max_workers=ANALYZE_STAGE_THREADS, thread_name_prefix='analyze-stage')
+    return _stage_executor
+
+
+def _json_default(obj):
+    """Serialize numpy scalars and arrays for the json fallback in json_response"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_response(payload, status_code: int = 200) -> Response:
+    """Serialize payload with orjson (faster than jsonify, handles numpy types)"""
+    try:
+        body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    except TypeError:
+        # orjson rejects integers beyond 64 bits, which parse_json_body keeps exact
+        body = json.dumps(payload, default=_json_default, separators=(',', ':')).encode('utf-8')
+    return Response(body, status=status_code, mimetype='application/json')
+
+
+# Constant response bodies, encoded once at import
+_HEALTH_BODY = orjson.dumps({'status': 'healthy', 'service': 'ml-engine'})
+_EMPTY_ANALYZE_BODY = orjson.dumps({
+    'clusters': [],
+    'posts': [],
+    'postsAnalyzed': 0,
+    'processingTimeMs': 0
+})
+_EMPTY_SENTIMENT_BODY = orjson.dumps({
+    'posts': [],
+    'count': 0
+})
+
+
+# Tiny synthetic corpus for warm_up(): two clearly separable topics so TF-IDF
+# and K-Means both run their real code paths
+_WARMUP_POSTS = [
+    {'id': 'warmup-1', 'content': 'Electric battery charging range is great'},
+    {'id': 'warmup-2', 'content': 'Charging the electric battery takes hours'},
+    {'id': 'warmup-3', 'content': 'Sleeper cab interior comfort is excellent'},
+    {'id': 'warmup-4', 'content': 'The sleeper interior and cab seat are comfortable'}
+]
+
+
+def warm_up():
+    """
+    Run a tiny analysis through the pipeline so the first real request
+    doesn't pay one-time costs (lexicon loading, sklearn/numpy first calls).
+    Uses VADER directly so warm-up never spends Gemini API calls.
+    """
+    from preprocessing import preprocess_posts
+    from sentiment import _analyze_sentiment_vader
+    from clustering import cluster_posts
+    
+    preprocessed = preprocess_posts(_WARMUP_POSTS)
+    for post in preprocessed:
+        _analyze_sentiment_vader(post['content'])
+    cluster_posts(preprocessed, n_clusters=2)
+
+
+def _with_etag(response: Response, etag: str) -> Response:
+    """Attach an ETag and require clients to revalidate before reusing the response"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _cached_analysis_response(entry: list, etag: str) -> Response:
+    """
+    Build an /api/analyze response from a response cache entry.
+    
+    Entries are [json_body, gzipped_body_or_None]; the gzipped bytes are
+    compressed on first use and reused on later replays. The gzip
+    representation gets its own '-gzip' ETag so the two encodings never
+    share a strong validator.
+    """
+    body = entry[0]
+    if len(body) < COMPRESS_MIN_SIZE or request.accept_encodings.quality('gzip') <= 0:
+        return _with_etag(Response(body, mimetype='application/json'), etag)
+    
+    if entry[1] is None:
+        entry[1] = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+    response = Response(entry[1], mimetype='application/json')
+    response.headers['Content-Encoding'] = 'gzip'
+    return _with_etag(response, etag + '-gzip')
+
 
 def make_error_response(code: str, message: str, details: str = None, status_code: int = 400):
     """Create a consistent JSON error response envelope"""
@@ -77,7 +221,63 @@ def make_error_response(code: str, message: str, details: str = None, status_cod
     }
     if details:
         error['error']['details'] = details
-    return jsonify(error), status_code
+    return json_response(error, status_code)
+
+
+# orjson decodes integers beyond 64 bits as floats, silently rounding them;
+# bodies containing a run of 19+ digits are decoded with json instead
+_LONG_INTEGER_RE = re.compile(rb'\d{19,}')
+
+
+def _reject_json_constant(name: str):
+    """Keep json.loads as strict as orjson about NaN and Infinity"""
+    raise ValueError(f"Invalid JSON constant: {name}")
+
+
+def require_json_content_type():
+    """
+    Check the request declares a JSON body, as request.get_json() did.
+    
+    Returns:
+        Error response if the Content-Type is not JSON, otherwise None
+    """
+    if request.is_json:
+        return None
+    logger.warning(f"Unsupported Content-Type: {request.content_type!r}")
+    return make_error_response(
+        'UNSUPPORTED_MEDIA_TYPE',
+        'Request body must be JSON',
+        'Content-Type must be application/json',
+        status_code=415
+    )
+
+
+def parse_json_body(body: bytes = None) -> tuple:
+    """
+    Parse the request body with orjson, bypassing Werkzeug's JSON parser and body cache.
+    
+    Args:
+        body: Raw body if the caller already read it (the stream can only be read once)
+    
+    Returns:
+        Tuple of (data_or_none, error_response_or_none)
+    """
+    error_response = require_json_content_type()
+    if error_response:
+        return None, error_response
+    if body is None:
+        body = request.get_data(cache=False)
+    try:
+        if _LONG_INTEGER_RE.search(body):
+            return json.loads(body, parse_constant=_reject_json_constant), None
+        return orjson.loads(body), None
+    except ValueError as e:
+        logger.warning(f"Malformed JSON in request body: {e}")
+        return None, make_error_response(
+            'INVALID_JSON',
+            'Malformed JSON in request body',
+            status_code=400
+        )
 
 
 def validate_posts(posts: list) -> tuple:
@@ -102,6 +302,12 @@ def validate_posts(posts: list) -> tuple:
             status_code=413
         )
     
+    # Fast path: one comprehension plus C-level all()/max() for the common
+    # all-valid payload; only walk posts individually to report an error
+    contents = [post.get('content') if isinstance(post, dict) and 'id' in post else None for post in posts]
+    if all(isinstance(c, str) for c in contents) and max(map(len, contents), default=0) <= MAX_CONTENT_LENGTH:
+        return True, None
+    
     for i, post in enumerate(posts):
         if not isinstance(post, dict):
             return False, make_error_response(
@@ -142,6 +348,75 @@ def validate_posts(posts: list) -> tuple:
     return True, None
 
 
+def preprocess_posts_cached(posts: list) -> list:
+    """Preprocess posts, reusing cached tokenization for previously seen content"""
+    processed = [None] * len(posts)
+    misses = []
+    for i, post in enumerate(posts):
+        cached = preprocess_cache.get(post.get('content', ''))
+        if cached is None:
+            misses.append(i)
+        else:
+            cleaned, tokens = cached
+            processed[i] = {**post, 'cleaned_content': cleaned, 'tokens': list(tokens)}
+    
+    if misses:
+        from preprocessing import preprocess_posts
+        results = preprocess_posts([posts[i] for i in misses])
+        for i, result in zip(misses, results):
+            preprocess_cache.set(result.get('content', ''), (result['cleaned_content'], tuple(result['tokens'])))
+            processed[i] = result
+    
+    return processed
+
+
+def analyze_posts_sentiment_cached(posts: list) -> list:
+    """Score sentiment for posts, only sending uncached content through the batcher"""
+    results = [None] * len(posts)
+    misses = []
+    for i, post in enumerate(posts):
+        cached = sentiment_cache.get(post.get('content', ''))
+        if cached is None:
+            misses.append(i)
+        else:
+            results[i] = {**post, 'sentiment': dict(cached)}
+    
+    if misses:
+        from sentiment import is_final_sentiment
+        scored = sentiment_batcher.predict([posts[i] for i in misses])
+        for i, result in zip(misses, scored):
+            content = result.get('content', '')
+            # Skip VADER fallbacks for failed Gemini calls so the content is retried
+            if is_final_sentiment(content, result['sentiment']):
+                sentiment_cache.set(content, dict(result['sentiment']))
+            results[i] = result
+    
+    return results
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Gzip large JSON responses for clients that send Accept-Encoding: gzip"""
+    if (response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers
+            or request.accept_encodings.quality('gzip') <= 0):
+        return response
+    
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    # A strong ETag identifies one encoding; give the gzipped bytes their own
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + '-gzip', weak)
+    return response
+
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Global error handler for unhandled exceptions"""
@@ -192,7 +467,7 @@ def health_check():
               type: string
               example: ml-engine
     """
-    return jsonify({'status': 'healthy', 'service': 'ml-engine'})
+    return Response(_HEALTH_BODY, mimetype='application/json')
 
 
 @app.route('/api/analyze', methods=['POST'])
@@ -286,11 +561,33 @@ def analyze():
       413:
         description: Payload too large
     """
-    start_time = time.time()
+    from clustering import cluster_posts
+    from sentiment import mean_sentiment_by_group, classify_sentiments
     
-    data = request.get_json()
+    start_ns = time.perf_counter_ns()
     
-    if not data or 'posts' not in data:
+    # Checked before the response cache so cached bodies are only served to JSON requests
+    error_response = require_json_content_type()
+    if error_response:
+        return error_response
+    
+    # Identical bodies produce the same analysis: answer from the ETag/response cache
+    body = request.get_data(cache=False)
+    cache_key = response_cache.key(ANALYSIS_CACHE_VERSION.encode('utf-8') + b'\0' + body)
+    etag = cache_key.hex()
+    for validator in (etag, etag + '-gzip'):
+        if request.if_none_match.contains(validator):
+            return _with_etag(Response(status=304), validator)
+    cached_entry = response_cache.get_by_key(cache_key)
+    if cached_entry is not None:
+        logger.info("Serving analysis from response cache")
+        return _cached_analysis_response(cached_entry, etag)
+    
+    data, error_response = parse_json_body(body)
+    if error_response:
+        return error_response
+    
+    if not isinstance(data, dict) or 'posts' not in data:
         logger.warning("Analyze request missing 'posts' field")
         return make_error_response(
             'MISSING_FIELD',
@@ -309,20 +606,20 @@ def analyze():
     
     if len(posts) == 0:
         logger.info("Empty post list, returning empty result")
-        return jsonify({
-            'clusters': [],
-            'posts': [],
-            'postsAnalyzed': 0,
-            'processingTimeMs': 0
-        })
+        return Response(_EMPTY_ANALYZE_BODY, mimetype='application/json')
     
     # Step 1: Preprocess posts (clean text, tokenize)
     logger.info("Step 1: Preprocessing posts...")
-    preprocessed = preprocess_posts(posts)
+    preprocessed = preprocess_posts_cached(posts)
     
-    # Step 2: Analyze sentiment for each post
+    # Step 2: Analyze sentiment for each post. Sentiment only needs content and
+    # clustering only needs tokens, so score in the background while clustering.
+    # Both stages annotate posts in place, so the sentiment stage gets its own
+    # shallow copies rather than writing to dicts cluster_posts is updating.
     logger.info("Step 2: Analyzing sentiment...")
-    with_sentiment = analyze_posts_sentiment(preprocessed)
+    sentiment_future = _get_stage_executor().submit(
+        analyze_posts_sentiment_cached, [post.copy() for post in preprocessed]
+    )
     
     # Step 3: Cluster posts by topic
     # Dynamic cluster count based on data size
@@ -330,43 +627,59 @@ def analyze():
     n_clusters = max(3, min(10, int(math.sqrt(len(posts) / 2))))
     n_clusters = min(n_clusters, len(posts))  # Don't create more clusters than posts
     logger.info(f"Step 3: Clustering into {n_clusters} clusters...")
-    clusters, clustered_posts = cluster_posts(with_sentiment, n_clusters=n_clusters)
+    clusters, clustered_posts = cluster_posts(preprocessed, n_clusters=n_clusters)
     
-    # Step 4: Calculate aggregate sentiment per cluster
-    logger.info("Step 4: Calculating cluster sentiments...")
-    for cluster in clusters:
-        cluster_post_ids = set(cluster.get('postIds', []))
-        cluster_posts_list = [p for p in clustered_posts if p.get('id') in cluster_post_ids]
-        
-        avg_sentiment = aggregate_cluster_sentiment(cluster_posts_list)
-        cluster['sentiment'] = round(avg_sentiment, 3)
-        cluster['sentimentLabel'] = classify_sentiment(avg_sentiment)
-    
-    # Calculate processing time
-    processing_time_ms = int((time.time() - start_time) * 1000)
-    logger.info(f"Analysis complete: {len(clusters)} clusters, {len(clustered_posts)} posts, {processing_time_ms}ms")
+    # Merge sentiment back (both stages preserve input order)
+    for post, scored in zip(clustered_posts, sentiment_future.result()):
+        post['sentiment'] = scored['sentiment']
     
-    # Prepare response (clean up internal fields from posts)
+    # Step 4: Calculate aggregate sentiment per cluster and build response posts.
+    # One pass over the posts collects each post's cluster position and score
+    # while emitting its response dict (public fields only; values are shared
+    # references, so content strings are never copied).
+    logger.info("Step 4: Calculating cluster sentiments...")
+    cluster_positions = {c['id']: i for i, c in enumerate(clusters) if 'id' in c}
+    group_ids = []
+    scores = []
     response_posts = []
     for post in clustered_posts:
-        response_post = {
+        sentiment = post.get('sentiment')
+        cluster_id = post.get('clusterId')
+        group_ids.append(cluster_positions.get(cluster_id, -1))
+        scores.append(sentiment.get('compound', 0.0) if sentiment else 0.0)
+        response_posts.append({
             'id': post.get('id'),
             'source': post.get('source'),
             'content': post.get('content'),
             'author': post.get('author'),
             'publishedAt': post.get('publishedAt'),
-            'sentiment': post.get('sentiment'),
-            'clusterId': post.get('clusterId'),
-            'keywords': post.get('tokens', [])[:10]  # Top 10 tokens as keywords
-        }
-        response_posts.append(response_post)
+            'sentiment': sentiment,
+            'clusterId': cluster_id,
+            'keywords': post.get('tokens', ())[:10]  # Top 10 tokens as keywords
+        })
     
-    return jsonify({
+    # Average all clusters at once
+    avg_sentiments = mean_sentiment_by_group(group_ids, scores, len(clusters))
+    # Python's round(), not ndarray.round(): numpy rounds scaled values and can
+    # differ in the last digit on halfway cases
+    for cluster, avg_sentiment, label in zip(clusters, [round(x, 3) for x in avg_sentiments.tolist()],
+                                             classify_sentiments(avg_sentiments).tolist()):
+        cluster['sentiment'] = avg_sentiment
+        cluster['sentimentLabel'] = label
+    
+    # Calculate processing time
+    processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+    logger.info(f"Analysis complete: {len(clusters)} clusters, {len(clustered_posts)} posts, {processing_time_ms}ms")
+    
+    response = json_response({
         'clusters': clusters,
         'posts': response_posts,
         'postsAnalyzed': len(posts),
         'processingTimeMs': processing_time_ms
     })
+    entry = [response.get_data(), None]
+    response_cache.set_by_key(cache_key, entry)
+    return _cached_analysis_response(entry, etag)
 
 
 @app.route('/api/sentiment', methods=['POST'])
@@ -426,10 +739,12 @@ def sentiment_only():
       413:
         description: Payload too large
     """
-    start_time = time.time()
-    data = request.get_json()
+    start_ns = time.perf_counter_ns()
+    data, error_response = parse_json_body()
+    if error_response:
+        return error_response
     
-    if not data or 'posts' not in data:
+    if not isinstance(data, dict) or 'posts' not in data:
         logger.warning("Sentiment request missing 'posts' field")
         return make_error_response(
             'MISSING_FIELD',
@@ -448,22 +763,58 @@ def sentiment_only():
     
     if len(posts) == 0:
         logger.info("Empty post list, returning empty result")
-        return jsonify({
-            'posts': [],
-            'count': 0
-        })
+        return Response(_EMPTY_SENTIMENT_BODY, mimetype='application/json')
     
-    results = analyze_posts_sentiment(posts)
-    processing_time_ms = int((time.time() - start_time) * 1000)
+    results = analyze_posts_sentiment_cached(posts)
+    processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
     logger.info(f"Sentiment analysis complete: {len(results)} posts, {processing_time_ms}ms")
     
-    return jsonify({
+    return json_response({
         'posts': results,
         'count': len(results)
     })
 
 
+@app.route('/api/cache/clear', methods=['POST'])
+def clear_cache():
+    """Clear cached preprocessing, sentiment, Gemini and analysis results
+    ---
+    tags:
+      - System
+    responses:
+      200:
+        description: Number of cache entries removed
+        schema:
+          type: object
+          properties:
+            preprocessCleared:
+              type: integer
+            sentimentCleared:
+              type: integer
+            responsesCleared:
+              type: integer
+            geminiCleared:
+              type: integer
+    """
+    from sentiment_gemini import gemini_cache
+    
+    preprocess_cleared = preprocess_cache.clear()
+    sentiment_cleared = sentiment_cache.clear()
+    responses_cleared = response_cache.clear()
+    gemini_cleared = gemini_cache.clear()
+    logger.info(f"Cleared caches: {preprocess_cleared} preprocess, {sentiment_cleared} sentiment, "
+                f"{responses_cleared} response, {gemini_cleared} Gemini entries")
+    
+    return json_response({
+        'preprocessCleared': preprocess_cleared,
+        'sentimentCleared': sentiment_cleared,
+        'responsesCleared': responses_cleared,
+        'geminiCleared': gemini_cleared
+    })
+
+
 if __name__ == '__main__':
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', '0') == '1'
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,110 @@
+"""
+Request micro-batching
+Coalesces items from concurrent requests into a single call to a batch function
+"""
+import threading
+import time
+from typing import Callable, List
+
+
+class _BatchJob:
+    """Items submitted by one caller plus a slot for their results"""
+
+    def __init__(self, items: list):
+        self.items = items
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Stack items from concurrent callers into one batch call, then fan results back.
+
+    The first caller to arrive becomes the batch leader. If no other batch is
+    running it flushes at once, so a lone request pays no added latency.
+    Otherwise it waits until `batch_size` items are pending, the running batch
+    finishes, or `max_latency` seconds have passed. It then runs `predict_fn`
+    once over every pending item and hands each caller back its own slice in
+    the original order. No background thread is used, so the batcher is safe
+    to create before gunicorn forks its workers.
+    """
+
+    def __init__(self, predict_fn: Callable[[list], list], batch_size: int = 256, max_latency: float = 0.02):
+        self.predict_fn = predict_fn
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._cond = threading.Condition()
+        self._pending: List[_BatchJob] = []
+        self._pending_count = 0
+        self._leader_active = False
+        self._running = 0
+
+    def predict(self, items: list) -> list:
+        """
+        Run `predict_fn` over items, possibly batched with other callers' items
+
+        Args:
+            items: Items to process
+
+        Returns:
+            Results for `items`, in the same order
+        """
+        if not items:
+            return []
+
+        job = _BatchJob(items)
+        with self._cond:
+            self._pending.append(job)
+            self._pending_count += len(items)
+            is_leader = not self._leader_active
+            if is_leader:
+                self._leader_active = True
+            else:
+                self._cond.notify_all()
+
+        if is_leader:
+            self._run_batch()
+
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _run_batch(self):
+        """Collect pending jobs (leader only) and process them in one call"""
+        deadline = time.monotonic() + self.max_latency
+        with self._cond:
+            # Items only pile up while another batch occupies predict_fn; with
+            # none running, waiting would just delay this caller
+            while self._pending_count < self.batch_size and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            jobs = self._pending
+            self._pending = []
+            self._pending_count = 0
+            self._leader_active = False
+            self._running += 1
+
+        batch = [item for job in jobs for item in job.items]
+        try:
+            results = self.predict_fn(batch)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch function returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for job in jobs:
+                job.error = e
+                job.done.set()
+            return
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+        offset = 0
+        for job in jobs:
+            job.result = results[offset:offset + len(job.items)]
+            offset += len(job.items)
+            job.done.set()
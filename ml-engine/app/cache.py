@@ -0,0 +1,65 @@
+"""
+Content-keyed caching
+LRU cache for per-post results keyed by a hash of the post content
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class ContentCache:
+    """
+    Thread-safe LRU cache keyed by a fast hash of post content.
+
+    Keys are 16-byte BLAKE2b digests, so memory use does not grow with
+    the length of the cached content.
+    """
+
+    def __init__(self, maxsize: int = 50000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content) -> bytes:
+        """Hash content (str or bytes) into a compact cache key"""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return hashlib.blake2b(content, digest_size=16).digest()
+
+    def get(self, content) -> Optional[Any]:
+        """Return the cached value for content, or None on a miss"""
+        return self.get_by_key(self.key(content))
+
+    def set(self, content, value: Any) -> None:
+        """Store a value for content, evicting the least recently used entry if full"""
+        self.set_by_key(self.key(content), value)
+
+    def get_by_key(self, key: bytes) -> Optional[Any]:
+        """Return the cached value for a precomputed key, or None on a miss"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set_by_key(self, key: bytes, value: Any) -> None:
+        """Store a value under a precomputed key"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> int:
+        """Remove all entries, returning how many were removed"""
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            return count
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -3,11 +3,52 @@ Clustering module for topic discovery
 Implements K-Means with TF-IDF for grouping posts by theme
 """
 from typing import List, Dict, Tuple
-from collections import Counter
+from collections import Counter, defaultdict
+from functools import lru_cache
+import os
+import re
 import uuid
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans, kmeans_plusplus
+from sklearn.metrics import pairwise_distances_argmin_min
+from sklearn.utils import check_random_state
+
+# Faiss is optional: its SIMD K-Means is much faster than sklearn's when installed
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+# Opt-in GPU training for the Faiss backend (requires a faiss-gpu build and a
+# visible CUDA device). Off by default: at MAX_POSTS_PER_REQUEST-sized inputs
+# host/device transfers cost more than the distance computations they save.
+FAISS_USE_GPU = (
+    FAISS_AVAILABLE
+    and os.environ.get('KMEANS_USE_GPU') == '1'
+    and hasattr(faiss, 'get_num_gpus')
+    and faiss.get_num_gpus() > 0
+)
+
+# K-Means settings shared by both backends
+KMEANS_SEED = 42
+# Faiss restarts (keeps the lowest-inertia run); gains past 3 are noise-level
+# on TF-IDF data. The scikit-learn backend runs once from k-means|| seeds.
+KMEANS_N_INIT = 3
+KMEANS_MAX_ITER = 300
+
+# k-means|| seeding rounds for the scikit-learn backend
+KMEANS_PARALLEL_ROUNDS = 5
+
+# Above this many documents the scikit-learn backend uses MiniBatchKMeans
+MINIBATCH_KMEANS_THRESHOLD = 1000
+MINIBATCH_KMEANS_MAX_ITER = 100
+
+# Bigram features are only built when posts average more tokens than this;
+# short social posts rarely repeat bigrams, so they mostly add noise and
+# vocabulary-building cost
+BIGRAM_MIN_MEAN_TOKENS = 40
 
 # Peterbilt-specific cluster taxonomy for labeling
 CLUSTER_TAXONOMY = {
@@ -61,11 +102,65 @@ CLUSTER_TAXONOMY = {
     }
 }
 
+# Normalized keyword sets per taxonomy entry, built once at import
+_TAXONOMY_KEYWORDS = {
+    key: frozenset(kw.lower().strip() for kw in taxonomy['keywords'])
+    for key, taxonomy in CLUSTER_TAXONOMY.items()
+}
+
+# Generic words and site names skipped when building fallback labels
+_GENERIC_LABEL_WORDS = frozenset([
+    'peterbilt', 'truck', 'trucks', 'driver', 'drivers', 'good', 'bad', 'great',
+    'reddit', 'com', 'sourcesite', '2019', 'posturl', 'publishedat'
+])
+_GENERIC_FALLBACK_WORDS = frozenset(['peterbilt', 'truck', 'reddit', 'com'])
+
+# Reverse index: taxonomy keyword -> taxonomy keys that list it
+_KEYWORD_INDEX = defaultdict(set)
+for _key, _keywords in _TAXONOMY_KEYWORDS.items():
+    for _kw in _keywords:
+        _KEYWORD_INDEX[_kw].add(_key)
+
+# Per-taxonomy substring matchers, built once so each direction of the
+# substring test is a single C-level scan instead of a loop over keywords:
+# - a newline-joined blob answers "keyword is inside some taxonomy keyword"
+#   (cluster keywords come from whitespace-split tokens, so never span a newline)
+# - an alternation regex answers "some taxonomy keyword is inside keyword"
+_TAXONOMY_BLOBS = {
+    key: '\n'.join(sorted(keywords))
+    for key, keywords in _TAXONOMY_KEYWORDS.items()
+}
+_TAXONOMY_PATTERNS = {
+    key: re.compile('|'.join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True)))
+    for key, keywords in _TAXONOMY_KEYWORDS.items()
+}
+
+
+@lru_cache(maxsize=4096)
+def _taxonomy_matches(keyword: str) -> frozenset:
+    """
+    Get taxonomy keys matching a lowercased cluster keyword
+    
+    A taxonomy matches when one of its keywords equals the keyword or either
+    is a substring of the other. Exact hits come from the reverse index; the
+    result is memoized since cluster keywords repeat across requests.
+    """
+    matches = set(_KEYWORD_INDEX.get(keyword, ()))
+    for key in _TAXONOMY_KEYWORDS:
+        if key in matches:
+            continue
+        if keyword in _TAXONOMY_BLOBS[key] or _TAXONOMY_PATTERNS[key].search(keyword):
+            matches.add(key)
+    return frozenset(matches)
+
 
 def cluster_posts(posts: List[dict], n_clusters: int = 4) -> Tuple[List[Dict], List[dict]]:
     """
     Cluster posts into topic groups using K-Means with TF-IDF
     
+    Clustered post dicts are annotated in place with 'clusterIdx' and
+    'clusterId' rather than copied.
+    
     Args:
         posts: List of preprocessed posts with 'tokens' field
         n_clusters: Number of clusters to create
@@ -77,6 +172,10 @@ def cluster_posts(posts: List[dict], n_clusters: int = 4) -> Tuple[List[Dict], L
         # Not enough posts to cluster meaningfully
         return [{'reason': 'insufficient_posts', 'message': f'Need at least {n_clusters} posts for clustering'}], posts
     
+    if n_clusters == 1:
+        # A single cluster needs no TF-IDF or K-Means (e.g. one-post requests)
+        return _build_single_cluster(posts)
+    
     # Build document strings from tokens
     documents = [' '.join(p.get('tokens', [])) for p in posts]
     
@@ -87,12 +186,13 @@ def cluster_posts(posts: List[dict], n_clusters: int = 4) -> Tuple[List[Dict], L
     
     valid_documents = [documents[i] for i in valid_indices]
     
-    # Create TF-IDF matrix
+    # Create TF-IDF matrix (unigrams only for short posts)
+    mean_tokens = sum(len(posts[i].get('tokens', [])) for i in valid_indices) / len(valid_indices)
     vectorizer = TfidfVectorizer(
         max_features=500,
         min_df=1,
         max_df=0.95,
-        ngram_range=(1, 2)
+        ngram_range=(1, 2) if mean_tokens > BIGRAM_MIN_MEAN_TOKENS else (1, 1)
     )
     
     try:
@@ -102,24 +202,18 @@ def cluster_posts(posts: List[dict], n_clusters: int = 4) -> Tuple[List[Dict], L
         return [{'reason': 'insufficient_vocabulary', 'message': 'Not enough unique terms for TF-IDF vectorization'}], posts
     
     # Run K-Means clustering
-    kmeans = KMeans(
-        n_clusters=n_clusters,
-        random_state=42,
-        n_init=10,
-        max_iter=300
-    )
-    cluster_labels = kmeans.fit_predict(tfidf_matrix)
+    cluster_labels, cluster_centers = _run_kmeans(tfidf_matrix, n_clusters)
     
     # Get feature names for keyword extraction
     feature_names = vectorizer.get_feature_names_out()
     
-    # Assign cluster labels back to posts
+    # Assign cluster labels back to posts (in place, no per-post copies) and
+    # group post indices by cluster in the same pass
     updated_posts = posts.copy()
-    for idx, valid_idx in enumerate(valid_indices):
-        updated_posts[valid_idx] = {
-            **updated_posts[valid_idx],
-            'clusterIdx': int(cluster_labels[idx])
-        }
+    members_by_cluster = [[] for _ in range(n_clusters)]
+    for valid_idx, label in zip(valid_indices, cluster_labels.tolist()):
+        updated_posts[valid_idx]['clusterIdx'] = label
+        members_by_cluster[label].append(valid_idx)
     
     # Build cluster objects
     clusters = []
@@ -127,14 +221,14 @@ def cluster_posts(posts: List[dict], n_clusters: int = 4) -> Tuple[List[Dict], L
     
     for cluster_idx in range(n_clusters):
         # Get posts in this cluster
-        cluster_post_indices = [valid_indices[i] for i, label in enumerate(cluster_labels) if label == cluster_idx]
+        cluster_post_indices = members_by_cluster[cluster_idx]
         cluster_posts_list = [updated_posts[i] for i in cluster_post_indices]
         
         if not cluster_posts_list:
             continue
         
         # Extract keywords from cluster centroid
-        centroid = kmeans.cluster_centers_[cluster_idx]
+        centroid = cluster_centers[cluster_idx]
         top_indices = centroid.argsort()[-15:][::-1]
         keywords = [feature_names[i] for i in top_indices]
         
@@ -163,6 +257,149 @@ def cluster_posts(posts: List[dict], n_clusters: int = 4) -> Tuple[List[Dict], L
     return clusters, updated_posts
 
 
+def _run_kmeans(tfidf_matrix, n_clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster TF-IDF rows with K-Means, using Faiss when available
+    
+    Args:
+        tfidf_matrix: Sparse TF-IDF matrix (one row per document)
+        n_clusters: Number of clusters to create
+        
+    Returns:
+        Tuple of (cluster label per row, cluster centroids)
+    """
+    if FAISS_AVAILABLE:
+        # Post counts are small (<= MAX_POSTS_PER_REQUEST), so densify once
+        X = np.ascontiguousarray(tfidf_matrix.toarray(), dtype=np.float32)
+        kmeans = faiss.Kmeans(
+            X.shape[1],
+            n_clusters,
+            niter=KMEANS_MAX_ITER,
+            nredo=KMEANS_N_INIT,
+            seed=KMEANS_SEED,
+            verbose=False,
+            min_points_per_centroid=1,
+            gpu=FAISS_USE_GPU
+        )
+        kmeans.train(X)
+        _, assignments = kmeans.index.search(X, 1)
+        return assignments.ravel(), kmeans.centroids
+    
+    # One run from k-means|| seeds instead of 10 k-means++ restarts
+    init_centers = kmeans_parallel_init(tfidf_matrix, n_clusters, random_state=KMEANS_SEED)
+    n_documents = tfidf_matrix.shape[0]
+    if n_documents > MINIBATCH_KMEANS_THRESHOLD:
+        # Large corpora: update centroids from mini-batches instead of every row
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            init=init_centers,
+            n_init=1,
+            batch_size=min(1024, n_documents // 4),
+            random_state=KMEANS_SEED,
+            max_iter=MINIBATCH_KMEANS_MAX_ITER
+        )
+    else:
+        kmeans = KMeans(
+            n_clusters=n_clusters,
+            init=init_centers,
+            n_init=1,
+            random_state=KMEANS_SEED,
+            max_iter=KMEANS_MAX_ITER
+        )
+    cluster_labels = kmeans.fit_predict(tfidf_matrix)
+    return cluster_labels, kmeans.cluster_centers_
+
+
+def kmeans_parallel_init(X, n_clusters: int, rounds: int = KMEANS_PARALLEL_ROUNDS,
+                         oversample: int = None, random_state=None) -> np.ndarray:
+    """
+    Pick initial K-Means centers with k-means|| (scalable k-means++)
+    
+    Each round samples about `oversample` points with probability proportional
+    to their squared distance from the current candidates. The candidates are
+    then weighted by how many points they are closest to and reduced to
+    `n_clusters` centers with weighted k-means++.
+    
+    Args:
+        X: Data matrix (dense or sparse), one row per document
+        n_clusters: Number of centers to return
+        rounds: Number of oversampling rounds
+        oversample: Expected points sampled per round (defaults to 2 * n_clusters)
+        random_state: Seed or RandomState for reproducibility
+        
+    Returns:
+        Dense array of shape (n_clusters, n_features)
+    """
+    rng = check_random_state(random_state)
+    n_samples = X.shape[0]
+    if oversample is None:
+        oversample = 2 * n_clusters
+    
+    candidates = np.array([rng.randint(n_samples)])
+    _, distances = pairwise_distances_argmin_min(X, X[candidates])
+    
+    for _ in range(rounds):
+        squared = distances ** 2
+        total = squared.sum()
+        if total == 0:
+            break
+        probabilities = np.minimum(1.0, oversample * squared / total)
+        sampled = np.flatnonzero(rng.random_sample(n_samples) < probabilities)
+        sampled = np.setdiff1d(sampled, candidates)
+        if sampled.size == 0:
+            continue
+        candidates = np.union1d(candidates, sampled)
+        _, new_distances = pairwise_distances_argmin_min(X, X[sampled])
+        distances = np.minimum(distances, new_distances)
+    
+    if candidates.size < n_clusters:
+        # Degenerate data (e.g. many duplicate rows): pad with random unused rows
+        unused = np.setdiff1d(np.arange(n_samples), candidates)
+        padding = rng.choice(unused, n_clusters - candidates.size, replace=False)
+        candidates = np.union1d(candidates, padding)
+    
+    closest, _ = pairwise_distances_argmin_min(X, X[candidates])
+    weights = np.bincount(closest, minlength=candidates.size).astype(np.float64)
+    centers, _ = kmeans_plusplus(X[candidates], n_clusters, sample_weight=weights, random_state=rng)
+    return centers
+
+
+def _build_single_cluster(posts: List[dict]) -> Tuple[List[Dict], List[dict]]:
+    """
+    Put every post with tokens into one cluster, using term frequency for keywords
+    
+    Args:
+        posts: List of preprocessed posts with 'tokens' field
+        
+    Returns:
+        Tuple of (clusters list, posts with cluster assignments)
+    """
+    valid_indices = [i for i, p in enumerate(posts) if p.get('tokens')]
+    if not valid_indices:
+        return [{'reason': 'insufficient_vocabulary', 'message': 'Not enough non-empty tokenized documents for clustering'}], posts
+    
+    cluster_posts_list = [posts[i] for i in valid_indices]
+    keywords = extract_cluster_keywords(cluster_posts_list, top_n=15)
+    taxonomy_id, label = match_cluster_to_taxonomy(keywords)
+    
+    cluster = {
+        'id': str(uuid.uuid4()),
+        'taxonomyId': taxonomy_id,
+        'label': label,
+        'description': CLUSTER_TAXONOMY.get(taxonomy_id, {}).get('description', ''),
+        'keywords': keywords[:10],
+        'postCount': len(cluster_posts_list),
+        'postIds': [p.get('id') for p in cluster_posts_list]
+    }
+    
+    updated_posts = posts.copy()
+    for i in valid_indices:
+        updated_posts[i]['clusterIdx'] = 0
+        updated_posts[i]['clusterId'] = cluster['id']
+    
+    return [cluster], updated_posts
+
+
 def extract_cluster_keywords(cluster_posts: List[dict], top_n: int = 10) -> List[str]:
     """
     Extract top keywords from a cluster of posts using term frequency
@@ -193,6 +430,9 @@ def match_cluster_to_taxonomy(keywords: List[str], exclude: set = None) -> Tuple
     """
     Match cluster keywords to predefined taxonomy using weighted scoring
     
+    Keywords are lowercased and stripped once on entry, so callers may pass
+    mixed-case tokens.
+    
     Args:
         keywords: List of cluster keywords
         exclude: Set of taxonomy_ids to exclude (already used)
@@ -203,32 +443,27 @@ def match_cluster_to_taxonomy(keywords: List[str], exclude: set = None) -> Tuple
     if exclude is None:
         exclude = set()
     
-    best_match = None
-    best_score = 0
+    # Normalize keywords once for matching
+    keywords_lower = [k.lower().strip() for k in keywords]
     
-    # Normalize keywords for matching
-    keywords_lower = [k.lower() for k in keywords]
-    keywords_set = set(keywords_lower)
+    # Score based on overlap, weighted by position in keyword list
+    # (higher weight for earlier keywords, which are more important)
+    scores = Counter()
+    for i, kw in enumerate(keywords_lower):
+        if not kw:
+            continue
+        weight = (len(keywords) - i) / len(keywords)
+        for key in _taxonomy_matches(kw):
+            scores[key] += weight
     
+    best_match = None
+    best_score = 0
     for key, taxonomy in CLUSTER_TAXONOMY.items():
         # Skip already-used taxonomy labels
         if key in exclude:
             continue
-            
-        taxonomy_keywords = set(k.lower() for k in taxonomy['keywords'])
-        
-        # Score based on overlap, weighted by position in keyword list
-        score = 0
-        for i, kw in enumerate(keywords_lower):
-            # Check for exact match or partial match
-            for tax_kw in taxonomy_keywords:
-                if tax_kw in kw or kw in tax_kw:
-                    # Higher weight for earlier keywords (more important)
-                    score += (len(keywords) - i) / len(keywords)
-                    break
-        
-        if score > best_score:
-            best_score = score
+        if scores[key] > best_score:
+            best_score = scores[key]
             best_match = (key, taxonomy['label'])
     
     if best_match and best_score > 0.5:
@@ -239,8 +474,7 @@ def match_cluster_to_taxonomy(keywords: List[str], exclude: set = None) -> Tuple
     label_keywords = []
     for kw in keywords_lower[:8]:  # Check top 8 keywords
         # Skip common/generic words and site names
-        if kw not in ['peterbilt', 'truck', 'trucks', 'driver', 'drivers', 'good', 'bad', 'great', 
-                      'reddit', 'com', 'sourcesite', '2019', 'posturl', 'publishedat']:
+        if kw and kw not in _GENERIC_LABEL_WORDS:
             label_keywords.append(kw.title())
         if len(label_keywords) >= 3:
             break
@@ -253,7 +487,7 @@ def match_cluster_to_taxonomy(keywords: List[str], exclude: set = None) -> Tuple
     else:
         # Absolute fallback - use first non-generic keyword
         fallback_kw = next((kw.title() for kw in keywords_lower[:10] 
-                           if kw not in ['peterbilt', 'truck', 'reddit', 'com']), 'General')
+                           if kw and kw not in _GENERIC_FALLBACK_WORDS), 'General')
         label = f'{fallback_kw} Discussion'
     
     # Create unique key
@@ -24,15 +24,28 @@ DOMAIN_STOP_WORDS = {
     'one', 'also', 'even', 'much', 'still', 'way', 'well'
 }
 
-# Combined stop words (NLTK + domain-specific)
-_stop_words = None
+# Text cleaning patterns, compiled once at import
+_URL_RE = re.compile(r'http\S+|www\S+')
+# Mentions are dropped and a hashtag's '#' is stripped in the same scan;
+# URLs stay a separate, earlier pass because they can start inside a
+# mention or hashtag (e.g. "@http://...").
+_MENTION_HASH_RE = re.compile(r'@\w+|#(?=\w)')
+_NON_ALNUM_RUN_RE = re.compile(r'[^a-zA-Z0-9\s]+')
+# Same substitution as _NON_ALNUM_RUN_RE for pure-ASCII text, as a C-level
+# character table (ASCII letters, digits and whitespace map to themselves)
+_NON_ALNUM_ASCII_TABLE = str.maketrans({
+    c: ' ' for c in map(chr, range(128))
+    if not (c.isascii() and (c.isalnum() or c.isspace()))
+})
 
-def _get_stop_words() -> set:
-    """Get combined stop words set"""
-    global _stop_words
-    if _stop_words is None:
-        _stop_words = set(stopwords.words('english')) | DOMAIN_STOP_WORDS
-    return _stop_words
+# With n_jobs > 1, batches at least this large are split across worker
+# processes; below it process start-up and pickling cost more than the work
+# saved. Web requests always run serially (n_jobs=1) so gunicorn workers
+# never each start a process pool.
+PARALLEL_PREPROCESS_MIN_POSTS = 1000
+
+# Combined stop words (NLTK + domain-specific), built once at import
+_STOP_WORDS = frozenset(stopwords.words('english')) | DOMAIN_STOP_WORDS
 
 
 def clean_text(text: str) -> str:
@@ -52,19 +65,20 @@ def clean_text(text: str) -> str:
     text = text.lower()
     
     # Remove URLs
-    text = re.sub(r'http\S+|www\S+', '', text)
+    text = _URL_RE.sub('', text)
     
     # Remove mentions and hashtags (keep the text)
-    text = re.sub(r'@\w+', '', text)
-    text = re.sub(r'#(\w+)', r'\1', text)
+    text = _MENTION_HASH_RE.sub('', text)
     
     # Remove special characters but keep alphanumeric and spaces
-    text = re.sub(r'[^a-zA-Z0-9\s]', ' ', text)
+    # (table lookup for ASCII text; the regex also handles non-ASCII characters)
+    if text.isascii():
+        text = text.translate(_NON_ALNUM_ASCII_TABLE)
+    else:
+        text = _NON_ALNUM_RUN_RE.sub(' ', text)
     
     # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    return text
+    return ' '.join(text.split())
 
 
 def tokenize(text: str) -> List[str]:
@@ -94,36 +108,62 @@ def remove_stop_words(tokens: List[str], custom_stop_words: set = None) -> List[
     Returns:
         Filtered token list
     """
-    stop_words = _get_stop_words()
+    stop_words = _STOP_WORDS
     
-    if custom_stop_words:
-        stop_words = stop_words | custom_stop_words
+    if not custom_stop_words:
+        return [t for t in tokens if len(t) > 2 and t not in stop_words]
     
-    return [t for t in tokens if t not in stop_words and len(t) > 2]
+    # Check both sets rather than copying the shared set into a union per call
+    return [
+        t for t in tokens
+        if len(t) > 2 and t not in stop_words and t not in custom_stop_words
+    ]
 
 
-def preprocess_posts(posts: List[dict]) -> List[dict]:
+def preprocess_posts(posts: List[dict], n_jobs: int = 1) -> List[dict]:
     """
     Preprocess a list of posts for ML analysis
     
+    With n_jobs > 1, large batches are split into one chunk per process
+    and processed in parallel.
+    
     Args:
         posts: List of post dictionaries with 'content' field
+        n_jobs: Processes for large batches; for offline batch callers only,
+            the web API keeps the default of 1
         
     Returns:
         Posts with added 'tokens' and 'cleaned_content' fields
     """
-    processed = []
+    if len(posts) >= PARALLEL_PREPROCESS_MIN_POSTS and n_jobs > 1:
+        return _preprocess_parallel(posts, n_jobs)
+    return _preprocess_chunk(posts)
+
+
+def _preprocess_parallel(posts: List[dict], n_jobs: int) -> List[dict]:
+    """Preprocess posts in contiguous chunks across processes, keeping order"""
+    from joblib import Parallel, delayed
     
-    for post in posts:
-        content = post.get('content', '')
-        cleaned = clean_text(content)
-        tokens = tokenize(cleaned)
-        filtered_tokens = remove_stop_words(tokens)
-        
-        processed.append({
-            **post,
-            'cleaned_content': cleaned,
-            'tokens': filtered_tokens
-        })
+    chunk_size = -(-len(posts) // n_jobs)
+    chunks = [posts[i:i + chunk_size] for i in range(0, len(posts), chunk_size)]
+    results = Parallel(n_jobs=n_jobs, backend='loky')(
+        delayed(_preprocess_chunk)(chunk) for chunk in chunks
+    )
+    return [post for chunk in results for post in chunk]
+
+
+def _preprocess_chunk(posts: List[dict]) -> List[dict]:
+    """Preprocess posts in the current process"""
+    # Column-wise passes: clean every post, then tokenize and filter stop words
+    cleaned = [clean_text(post.get('content', '')) for post in posts]
+    stop_words = _STOP_WORDS
+    
+    processed = []
+    for post, text in zip(posts, cleaned):
+        # dict.copy() plus two stores is cheaper than rebuilding via {**post}
+        result = post.copy()
+        result['cleaned_content'] = text
+        result['tokens'] = [t for t in text.split() if len(t) > 2 and t not in stop_words]
+        processed.append(result)
     
     return processed
@@ -1,12 +1,20 @@
 """
 Sentiment analysis module
 Uses Google Gemini for context-aware sentiment scoring
-Falls back to NLTK VADER if Gemini is unavailable
+Falls back to NLTK VADER if Gemini is unavailable; batch scoring uses VADER
+first and only sends posts it is unsure about to Gemini
 """
 import logging
-from typing import List, Dict
-import nltk
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, List
+import numpy as np
+
+# NLTK (~1s to import) and joblib are imported on first use, so callers that
+# only need the score helpers below import this module cheaply
+if TYPE_CHECKING:
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
 # Import Gemini sentiment module
 try:
@@ -21,17 +29,32 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
-# Verify VADER lexicon is available (must be pre-installed)
-try:
-    nltk.data.find('sentiment/vader_lexicon.zip')
-except LookupError:
-    raise RuntimeError(
-        "NLTK 'vader_lexicon' not found. Please install it before starting the service: "
-        "python -c \"import nltk; nltk.download('vader_lexicon')\""
-    )
+# Compound score thresholds for sentiment labels
+POSITIVE_THRESHOLD = 0.3
+NEGATIVE_THRESHOLD = -0.3
+
+# Canonical score for posts with no text
+NEUTRAL_SENTIMENT = {'compound': 0.0, 'positive': 0.0, 'negative': 0.0, 'neutral': 1.0}
 
-# Initialize VADER analyzer (singleton)
+# Labels indexed by (score >= POSITIVE) - (score <= NEGATIVE) + 1
+_SENTIMENT_LABELS = np.array(['negative', 'neutral', 'positive'])
+
+# With n_jobs > 1, VADER batches at least this large are scored across worker
+# processes; below it process start-up and pickling cost more than the work
+# saved. Web requests always score serially (n_jobs=1): a loky pool per
+# gunicorn worker would oversubscribe the CPUs, and at MAX_POSTS_PER_REQUEST
+# serial VADER takes well under 0.1s.
+PARALLEL_VADER_MIN_POSTS = 500
+
+# When Gemini is available, posts are scored with VADER first and only sent
+# to Gemini if VADER is unsure (|compound| below this) or the post uses
+# context-dependent domain slang. Set above 1 to send every post to Gemini.
+GEMINI_ESCALATION_THRESHOLD = float(os.environ.get('GEMINI_ESCALATION_THRESHOLD', '0.5'))
+
+# Initialize VADER analyzer (singleton, shared by all threads: scoring only
+# reads the lexicon)
 _sia = None
+_sia_lock = threading.Lock()
 
 # Custom lexicon updates for trucking/automotive domain
 # Positive values = positive sentiment, negative values = negative sentiment
@@ -63,13 +86,35 @@ CUSTOM_LEXICON = {
     'not': -0.5,        # negation (VADER handles this but reinforce)
 }
 
-def _get_analyzer() -> SentimentIntensityAnalyzer:
+# Lexicon terms are single words, so a post uses one if any of its words is
+# in this set: one tokenizing pass plus hash lookups, independent of lexicon size
+_LEXICON_WORDS = frozenset(CUSTOM_LEXICON)
+_WORD_RE = re.compile(r'\w+')
+
+def _get_analyzer() -> 'SentimentIntensityAnalyzer':
     """Get or create VADER analyzer singleton with custom lexicon"""
     global _sia
     if _sia is None:
-        _sia = SentimentIntensityAnalyzer()
-        # Update lexicon with domain-specific terms
-        _sia.lexicon.update(CUSTOM_LEXICON)
+        with _sia_lock:
+            if _sia is None:
+                import nltk
+                from nltk.sentiment.vader import SentimentIntensityAnalyzer
+                
+                # Verify VADER lexicon is available (must be pre-installed;
+                # wsgi.py loads it in the gunicorn master, before forking)
+                try:
+                    nltk.data.find('sentiment/vader_lexicon.zip')
+                except LookupError:
+                    raise RuntimeError(
+                        "NLTK 'vader_lexicon' not found. Please install it before starting the service: "
+                        "python -c \"import nltk; nltk.download('vader_lexicon')\""
+                    )
+                
+                sia = SentimentIntensityAnalyzer()
+                # Update lexicon with domain-specific terms before publishing,
+                # so no thread can score without them
+                sia.lexicon.update(CUSTOM_LEXICON)
+                _sia = sia
     return _sia
 
 
@@ -91,12 +136,7 @@ def analyze_sentiment(text: str) -> Dict:
         }
     """
     if not text or not text.strip():
-        return {
-            'compound': 0.0,
-            'positive': 0.0,
-            'negative': 0.0,
-            'neutral': 1.0
-        }
+        return dict(NEUTRAL_SENTIMENT)
     
     # Try Gemini first for better context understanding
     if GEMINI_IMPORTED and is_gemini_available():
@@ -123,56 +163,145 @@ def _analyze_sentiment_vader(text: str) -> Dict:
     }
 
 
-def analyze_posts_sentiment(posts: List[dict]) -> List[dict]:
+def analyze_posts_sentiment(posts: List[dict], copy: bool = False, n_jobs: int = 1) -> List[dict]:
     """
     Add sentiment scores to a list of posts
-    Uses Gemini batch processing if available, falls back to VADER
+    Scores with VADER, re-scoring uncertain posts with Gemini batch
+    processing if available
+    
+    Posts are annotated in place unless `copy` is set; every post gets its
+    own sentiment dict, even when its content repeats another post's and is
+    scored once. Posts with empty or whitespace-only
+    content get NEUTRAL_SENTIMENT without being sent to either scorer.
     
     Args:
         posts: List of post dictionaries with 'content' field
+        copy: Return annotated copies instead of adding 'sentiment' in place
+        n_jobs: Processes for VADER scoring of large batches; for offline
+            batch callers only, the web API keeps the default of 1
         
     Returns:
         Posts with added 'sentiment' field
     """
-    # Try Gemini batch processing first (more efficient)
-    if GEMINI_IMPORTED and is_gemini_available():
-        logger.info(f"Using Gemini for sentiment analysis of {len(posts)} posts")
-        result = analyze_posts_sentiment_gemini(posts)
-        if result:
-            return result
-        logger.warning("Gemini batch analysis failed, falling back to VADER")
+    has_text = [bool((post.get('content') or '').strip()) for post in posts]
+    if all(has_text):
+        return _analyze_posts_with_text(posts, copy, n_jobs)
     
-    # Fallback to VADER (individual processing)
-    logger.info(f"Using VADER for sentiment analysis of {len(posts)} posts")
+    scored = iter(_analyze_posts_with_text([p for p, t in zip(posts, has_text) if t], copy, n_jobs))
     results = []
+    for post, text in zip(posts, has_text):
+        if text:
+            results.append(next(scored))
+        else:
+            result = post.copy() if copy else post
+            result['sentiment'] = dict(NEUTRAL_SENTIMENT)
+            results.append(result)
+    return results
+
+
+def _analyze_posts_with_text(posts: List[dict], copy: bool, n_jobs: int) -> List[dict]:
+    """Score posts that all have non-blank content (see analyze_posts_sentiment)"""
+    if not posts:
+        return []
     
-    for post in posts:
-        content = post.get('content', '')
-        sentiment = _analyze_sentiment_vader(content)
-        
-        results.append({
-            **post,
-            'sentiment': sentiment
-        })
+    # VADER scores every post, each unique text once (reposts get copies of its score)
+    texts = [post['content'] for post in posts]
+    sentiments = _score_vader(texts, n_jobs)
     
+    # Escalate the posts VADER cannot call confidently to Gemini
+    if GEMINI_IMPORTED and is_gemini_available():
+        escalate = [i for i, (text, sentiment) in enumerate(zip(texts, sentiments))
+                    if _needs_gemini(text, sentiment)]
+        if escalate:
+            logger.info(f"Using Gemini for sentiment analysis of {len(escalate)}/{len(posts)} posts")
+            result = analyze_posts_sentiment_gemini([posts[i] for i in escalate], copy=True)
+            if result:
+                for i, scored in zip(escalate, result):
+                    sentiments[i] = scored['sentiment']
+            else:
+                logger.warning("Gemini batch analysis failed, falling back to VADER")
+    
+    results = []
+    for post, sentiment in zip(posts, sentiments):
+        result = post.copy() if copy else post
+        result['sentiment'] = sentiment
+        results.append(result)
     return results
 
 
-def aggregate_cluster_sentiment(posts: List[dict]) -> float:
+def is_final_sentiment(text: str, sentiment: Dict) -> bool:
+    """
+    Whether a score from analyze_posts_sentiment can be cached by content
+    
+    While Gemini is available, a score for a post that qualifies for
+    escalation may be a VADER fallback from a failed Gemini call, so it is
+    not final. Gemini's own scores for those posts are kept in its content
+    cache, so re-scoring them later costs no API call.
+    """
+    if not text.strip() or not (GEMINI_IMPORTED and is_gemini_available()):
+        return True
+    return not _needs_gemini(text, sentiment)
+
+
+def _needs_gemini(text: str, vader_sentiment: Dict) -> bool:
+    """Whether a post's VADER score is too uncertain to keep without Gemini"""
+    return (abs(vader_sentiment['compound']) < GEMINI_ESCALATION_THRESHOLD
+            or not _LEXICON_WORDS.isdisjoint(_WORD_RE.findall(text.lower())))
+
+
+def _score_vader(texts: List[str], n_jobs: int = 1) -> List[Dict]:
+    """Score texts with VADER, each unique text once (across processes for large batches if n_jobs > 1)"""
+    logger.info(f"Using VADER for sentiment analysis of {len(texts)} posts")
+    unique_texts = list(dict.fromkeys(texts))
+    if len(unique_texts) >= PARALLEL_VADER_MIN_POSTS and n_jobs > 1:
+        sentiments = _score_vader_parallel(unique_texts, n_jobs)
+    else:
+        sentiments = _score_vader_chunk(unique_texts)
+    
+    if len(unique_texts) < len(texts):
+        by_text = dict(zip(unique_texts, sentiments))
+        sentiments = [dict(by_text[text]) for text in texts]
+    return sentiments
+
+
+def _score_vader_parallel(texts: List[str], n_jobs: int) -> List[Dict]:
+    """Score texts with VADER in contiguous chunks across processes, keeping order"""
+    from joblib import Parallel, delayed
+    
+    chunk_size = -(-len(texts) // n_jobs)
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    results = Parallel(n_jobs=n_jobs, backend='loky')(
+        delayed(_score_vader_chunk)(chunk) for chunk in chunks
+    )
+    return [sentiment for chunk in results for sentiment in chunk]
+
+
+def _score_vader_chunk(texts: List[str]) -> List[Dict]:
+    """Score texts with VADER in the current process"""
+    return [_analyze_sentiment_vader(text) for text in texts]
+
+
+def aggregate_cluster_sentiment(posts: Iterable[dict]) -> float:
     """
     Calculate aggregate sentiment for a cluster of posts
     
+    Folds a running sum and count, so posts may be any iterable (including
+    a generator) and are never materialized as a list.
+    
     Args:
-        posts: List of posts with 'sentiment' field
+        posts: Posts with 'sentiment' field
         
     Returns:
         Average compound sentiment score (-1 to 1)
     """
-    if not posts:
-        return 0.0
-    
-    total = sum(p.get('sentiment', {}).get('compound', 0.0) for p in posts)
-    return total / len(posts)
+    total = 0.0
+    count = 0
+    for post in posts:
+        sentiment = post.get('sentiment')
+        if sentiment:
+            total += sentiment.get('compound', 0.0)
+        count += 1
+    return total / count if count else 0.0
 
 
 def classify_sentiment(score: float) -> str:
@@ -185,9 +314,46 @@ def classify_sentiment(score: float) -> str:
     Returns:
         Category string: 'positive', 'negative', or 'neutral'
     """
-    if score >= 0.3:
+    if score >= POSITIVE_THRESHOLD:
         return 'positive'
-    elif score <= -0.3:
+    elif score <= NEGATIVE_THRESHOLD:
         return 'negative'
     else:
         return 'neutral'
+
+
+def mean_sentiment_by_group(group_ids: List[int], scores: List[float], n_groups: int) -> np.ndarray:
+    """
+    Average compound scores per group in one vectorized pass
+    
+    Args:
+        group_ids: Group index per score; values outside 0..n_groups-1 are ignored
+        scores: Compound sentiment score per item
+        n_groups: Number of groups
+        
+    Returns:
+        Array of mean scores per group (0.0 for empty groups)
+    """
+    group_ids = np.asarray(group_ids, dtype=np.intp)
+    scores = np.asarray(scores, dtype=np.float64)
+    
+    # Route out-of-range ids to an overflow bucket that is dropped afterwards
+    group_ids = np.where((group_ids >= 0) & (group_ids < n_groups), group_ids, n_groups)
+    sums = np.bincount(group_ids, weights=scores, minlength=n_groups + 1)[:n_groups]
+    counts = np.bincount(group_ids, minlength=n_groups + 1)[:n_groups]
+    return np.divide(sums, counts, out=np.zeros(n_groups), where=counts > 0)
+
+
+def classify_sentiments(scores: np.ndarray) -> np.ndarray:
+    """
+    Classify an array of sentiment scores (vectorized classify_sentiment)
+    
+    Args:
+        scores: Compound sentiment scores (-1 to 1)
+        
+    Returns:
+        Array of 'positive', 'negative', or 'neutral' labels
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    idx = (scores >= POSITIVE_THRESHOLD).astype(np.intp) - (scores <= NEGATIVE_THRESHOLD) + 1
+    return _SENTIMENT_LABELS[idx]
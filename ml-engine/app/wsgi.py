@@ -0,0 +1,24 @@
+"""
+WSGI entry point for production servers (see gunicorn.conf.py)
+"""
+import os
+
+# gevent workers need the stdlib patched before anything creates locks or
+# sockets; the app is preloaded in the master, before workers patch themselves
+if os.environ.get('GUNICORN_WORKER_CLASS') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from api import app  # noqa: E402
+
+# Load the ML pipeline up front so preloaded workers share it copy-on-write
+import preprocessing  # noqa: F401,E402
+import sentiment  # noqa: F401,E402
+import clustering  # noqa: F401,E402
+
+# Build the VADER analyzer here, in the preloading master: workers inherit the
+# lexicon copy-on-write, and a missing vader_lexicon aborts startup instead of
+# surfacing later as per-request 500s
+sentiment._get_analyzer()
+
+__all__ = ['app']
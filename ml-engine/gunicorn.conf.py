@@ -0,0 +1,42 @@
+"""
+Gunicorn configuration for the ML Engine
+Run from the ml-engine directory: gunicorn
+"""
+import os
+
+# Application modules use flat imports (e.g. `from preprocessing import ...`)
+pythonpath = 'app'
+wsgi_app = 'wsgi:app'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Threaded workers: sklearn/numpy release the GIL inside BLAS, so threads
+# overlap well with CPU-bound work. Set GUNICORN_WORKER_CLASS=gevent (requires
+# the gevent package) for deployments dominated by outbound Gemini calls or
+# cache hits; wsgi.py then monkey-patches the stdlib before loading the app.
+# sklearn's native code does not yield to gevent, so keep gthread otherwise.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '5'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+
+# Load the app (NLTK corpora, sklearn) once in the master and fork workers
+# from it so the read-only pages are shared copy-on-write
+preload_app = True
+
+# Recycle workers periodically to bound memory creep from sklearn/numpy
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Warm up the ML pipeline in each new worker so its first request isn't slow"""
+    try:
+        from api import warm_up
+        warm_up()
+    except Exception as e:
+        server.log.warning(f"Worker warm-up failed: {e}")
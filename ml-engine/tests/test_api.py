@@ -1,21 +1,66 @@
 """
 Tests for Flask API endpoints
 """
-import sys
-import os
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
-
 import pytest
+import gzip
+from unittest.mock import patch
 import json
-from api import app
+
+
+# Invalid request bodies shared by /api/analyze and /api/sentiment:
+# (payload, expected status, expected error code). Size cases are checked
+# against the reduced limits set by the small_limits fixture.
+INVALID_REQUESTS = [
+    pytest.param({}, 400, 'MISSING_FIELD', id='missing-posts'),
+    pytest.param({'posts': [{"content": "Test content"}]}, 400, 'MISSING_FIELD', id='missing-post-id'),
+    pytest.param({'posts': [{"id": "1"}]}, 400, 'MISSING_FIELD', id='missing-post-content'),
+    pytest.param({'posts': ["just a string"]}, 400, 'INVALID_POST', id='non-object-post'),
+    pytest.param({'posts': [{"id": str(i), "content": f"Test {i}"} for i in range(4)]},
+                 413, 'PAYLOAD_TOO_LARGE', id='too-many-posts'),
+    pytest.param({'posts': [{"id": "1", "content": "x" * 21}]}, 413, 'CONTENT_TOO_LARGE', id='content-too-long'),
+]
 
 
 @pytest.fixture
-def client():
-    """Create test client"""
-    app.config['TESTING'] = True
-    with app.test_client() as client:
-        yield client
+def small_limits():
+    """Shrink request limits to 3 posts of 20 characters so over-limit payloads stay tiny"""
+    with patch('api.MAX_POSTS_PER_REQUEST', 3), patch('api.MAX_CONTENT_LENGTH', 20):
+        yield
+
+
+VALID_ANALYZE_POSTS = [
+    {"id": "1", "content": "Great truck performance!", "source": "twitter"},
+    {"id": "2", "content": "Love the new 579 model", "source": "forums"},
+    {"id": "3", "content": "Amazing torque on this beast", "source": "youtube"}
+]
+
+
+@pytest.fixture(scope='module')
+def analyze_response(client):
+    """One /api/analyze response for a valid request, shared by the structural checks"""
+    return client.post('/api/analyze', json={'posts': VALID_ANALYZE_POSTS})
+
+
+@pytest.fixture(scope='module')
+def sentiment_response(client):
+    """One /api/sentiment response for a valid request, shared by the structural checks"""
+    posts = [
+        {"id": "1", "content": "Great truck!"},
+        {"id": "2", "content": "Terrible experience."}
+    ]
+    return client.post('/api/sentiment', json={'posts': posts})
+
+
+class TestWarmUp:
+    """Tests for worker warm-up"""
+    
+    @pytest.mark.unit
+    def test_warm_up_runs_without_gemini(self):
+        """Warm-up should exercise the pipeline without calling Gemini"""
+        from api import warm_up
+        with patch('sentiment_gemini.analyze_posts_sentiment_gemini') as gemini:
+            warm_up()
+        gemini.assert_not_called()
 
 
 class TestHealthEndpoint:
@@ -31,7 +76,7 @@ class TestHealthEndpoint:
     def test_health_returns_healthy_status(self, client):
         """Health check should return healthy status"""
         response = client.get('/health')
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['status'] == 'healthy'
         assert data['service'] == 'ml-engine'
 
@@ -40,154 +85,238 @@ class TestAnalyzeEndpoint:
     """Tests for /api/analyze endpoint"""
     
     @pytest.mark.unit
-    def test_missing_posts_returns_400(self, client):
-        """Request without posts should return 400"""
-        response = client.post('/api/analyze', 
-                               json={},
-                               content_type='application/json')
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert 'error' in data
-        assert data['error']['code'] == 'MISSING_FIELD'
+    @pytest.mark.parametrize('payload,status,code', INVALID_REQUESTS)
+    def test_invalid_request_returns_error(self, client, small_limits, payload, status, code):
+        """Invalid requests should be rejected with the matching status and error code"""
+        response = client.post('/api/analyze', json=payload)
+        assert response.status_code == status
+        data = response.get_json()
+        assert data['error']['code'] == code
     
     @pytest.mark.unit
     def test_empty_posts_returns_empty_result(self, client):
         """Empty posts array should return empty result"""
-        response = client.post('/api/analyze',
-                               json={'posts': []},
-                               content_type='application/json')
+        response = client.post('/api/analyze', json={'posts': []})
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['clusters'] == []
         assert data['posts'] == []
         assert data['postsAnalyzed'] == 0
     
     @pytest.mark.unit
-    def test_valid_request_returns_200(self, client):
+    def test_valid_request_returns_200(self, analyze_response):
         """Valid request should return 200 with results"""
-        posts = [
-            {"id": "1", "content": "Great truck performance!", "source": "twitter"},
-            {"id": "2", "content": "Love the new 579 model", "source": "forums"},
-            {"id": "3", "content": "Amazing torque on this beast", "source": "youtube"}
-        ]
-        response = client.post('/api/analyze',
-                               json={'posts': posts},
-                               content_type='application/json')
-        assert response.status_code == 200
-        data = json.loads(response.data)
+        assert analyze_response.status_code == 200
+        data = analyze_response.get_json()
         assert 'clusters' in data
         assert 'posts' in data
         assert data['postsAnalyzed'] == 3
         assert 'processingTimeMs' in data
     
     @pytest.mark.unit
-    def test_posts_have_sentiment(self, client):
+    def test_posts_have_sentiment(self, analyze_response):
         """Returned posts should have sentiment scores"""
-        posts = [{"id": "1", "content": "Great truck!", "source": "twitter"}]
-        response = client.post('/api/analyze',
-                               json={'posts': posts},
-                               content_type='application/json')
-        data = json.loads(response.data)
-        assert 'sentiment' in data['posts'][0]
+        data = analyze_response.get_json()
+        assert all('sentiment' in post for post in data['posts'])
     
     @pytest.mark.unit
-    def test_missing_post_id_returns_400(self, client):
-        """Post without id should return 400"""
-        posts = [{"content": "Test content"}]
-        response = client.post('/api/analyze',
-                               json={'posts': posts},
-                               content_type='application/json')
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert data['error']['code'] == 'MISSING_FIELD'
+    def test_posts_keep_public_fields(self, analyze_response):
+        """Returned posts should carry their id, source and content in input order"""
+        data = analyze_response.get_json()
+        assert [(p['id'], p['source'], p['content']) for p in data['posts']] == [
+            (p['id'], p['source'], p['content']) for p in VALID_ANALYZE_POSTS
+        ]
     
     @pytest.mark.unit
-    def test_missing_post_content_returns_400(self, client):
-        """Post without content should return 400"""
-        posts = [{"id": "1"}]
-        response = client.post('/api/analyze',
-                               json={'posts': posts},
-                               content_type='application/json')
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert data['error']['code'] == 'MISSING_FIELD'
+    def test_single_post_gets_single_cluster(self, client):
+        """A single post should be placed in one cluster with sentiment"""
+        posts = [{"id": "1", "content": "Electric battery charging is fantastic", "source": "twitter"}]
+        response = client.post('/api/analyze', json={'posts': posts})
+        data = response.get_json()
+        assert len(data['clusters']) == 1
+        assert data['clusters'][0]['postIds'] == ["1"]
+        assert data['clusters'][0]['sentimentLabel'] == 'positive'
+        assert data['posts'][0]['clusterId'] == data['clusters'][0]['id']
     
     @pytest.mark.unit
-    def test_too_many_posts_returns_413(self, client):
-        """Exceeding max posts should return 413"""
-        # Create more posts than the limit (default 500)
-        posts = [{"id": str(i), "content": f"Test {i}"} for i in range(501)]
-        response = client.post('/api/analyze',
-                               json={'posts': posts},
-                               content_type='application/json')
-        assert response.status_code == 413
-        data = json.loads(response.data)
-        assert data['error']['code'] == 'PAYLOAD_TOO_LARGE'
+    def test_clustered_posts_keep_their_sentiment(self, client):
+        """Sentiment scored alongside clustering should land on the matching posts"""
+        posts = [
+            {"id": "1", "content": "Electric battery charging range is amazing"},
+            {"id": "2", "content": "Terrible breakdown, engine repair again"},
+            {"id": "3", "content": "Sleeper interior comfort is great"},
+            {"id": "4", "content": "Awful dealer service and maintenance delays"},
+            {"id": "5", "content": "Love the EV charger and kwh numbers"},
+            {"id": "6", "content": "Cab seat mattress space is excellent"}
+        ]
+        response = client.post('/api/analyze', json={'posts': posts})
+        data = response.get_json()
+        by_id = {p['id']: p for p in data['posts']}
+        assert by_id['1']['sentiment']['compound'] > 0
+        assert by_id['2']['sentiment']['compound'] < 0
+        assert all('sentimentLabel' in c for c in data['clusters'])
     
     @pytest.mark.unit
-    def test_content_too_long_returns_413(self, client):
-        """Post with content exceeding max length should return 413"""
-        posts = [{"id": "1", "content": "x" * 10001}]  # Default max is 10000
-        response = client.post('/api/analyze',
-                               json={'posts': posts},
-                               content_type='application/json')
-        assert response.status_code == 413
-        data = json.loads(response.data)
-        assert data['error']['code'] == 'CONTENT_TOO_LARGE'
+    def test_non_string_content_returns_400(self, client):
+        """Post with non-string content should return 400"""
+        posts = [{"id": "1", "content": "ok"}, {"id": "2", "content": 42}]
+        response = client.post('/api/analyze', json={'posts': posts})
+        assert response.status_code == 400
+        data = response.get_json()
+        assert data['error']['code'] == 'INVALID_FIELD'
+        assert 'index 1' in data['error']['message']
 
 
 class TestSentimentEndpoint:
     """Tests for /api/sentiment endpoint"""
     
     @pytest.mark.unit
-    def test_missing_posts_returns_400(self, client):
-        """Request without posts should return 400"""
-        response = client.post('/api/sentiment',
-                               json={},
-                               content_type='application/json')
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert 'error' in data
+    @pytest.mark.parametrize('payload,status,code', INVALID_REQUESTS)
+    def test_invalid_request_returns_error(self, client, small_limits, payload, status, code):
+        """Invalid requests should be rejected with the matching status and error code"""
+        response = client.post('/api/sentiment', json=payload)
+        assert response.status_code == status
+        data = response.get_json()
+        assert data['error']['code'] == code
     
     @pytest.mark.unit
     def test_empty_posts_returns_empty_result(self, client):
         """Empty posts array should return empty result"""
-        response = client.post('/api/sentiment',
-                               json={'posts': []},
-                               content_type='application/json')
+        response = client.post('/api/sentiment', json={'posts': []})
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['posts'] == []
         assert data['count'] == 0
     
     @pytest.mark.unit
-    def test_valid_request_returns_200(self, client):
+    def test_valid_request_returns_200(self, sentiment_response):
         """Valid request should return 200 with sentiment"""
-        posts = [
-            {"id": "1", "content": "Great truck!"},
-            {"id": "2", "content": "Terrible experience."}
-        ]
-        response = client.post('/api/sentiment',
-                               json={'posts': posts},
-                               content_type='application/json')
-        assert response.status_code == 200
-        data = json.loads(response.data)
+        assert sentiment_response.status_code == 200
+        data = sentiment_response.get_json()
         assert len(data['posts']) == 2
         assert data['count'] == 2
     
     @pytest.mark.unit
-    def test_posts_have_sentiment_scores(self, client):
+    def test_posts_have_sentiment_scores(self, sentiment_response):
         """Returned posts should have sentiment scores"""
-        posts = [{"id": "1", "content": "Amazing performance!"}]
+        data = sentiment_response.get_json()
+        for post in data['posts']:
+            assert set(post['sentiment']) >= {'compound', 'positive', 'negative', 'neutral'}
+
+
+class TestCacheEndpoint:
+    """Tests for /api/cache/clear endpoint"""
+    
+    @pytest.mark.unit
+    def test_repeated_content_served_from_cache(self, client):
+        """Identical content should reuse the cached sentiment"""
+        client.post('/api/cache/clear')
+        posts = [{"id": "1", "content": "Cached truck review"}]
+        first = client.post('/api/sentiment', json={'posts': posts}).get_json()
+        posts = [{"id": "2", "content": "Cached truck review"}]
+        second = client.post('/api/sentiment', json={'posts': posts}).get_json()
+        assert second['posts'][0]['id'] == "2"
+        assert second['posts'][0]['sentiment'] == first['posts'][0]['sentiment']
+    
+    @pytest.mark.unit
+    def test_gemini_fallback_not_cached(self, client):
+        """A VADER fallback after a failed Gemini call should not be cached"""
+        import api
+        client.post('/api/cache/clear')
+        posts = [{"id": "1", "content": "The truck arrived on Tuesday."}]
+        gemini_sentiment = {'compound': 0.6, 'positive': 0.6, 'negative': 0.0, 'neutral': 0.4}
+        
+        def gemini_ok(batch, copy=False):
+            return [{**post, 'sentiment': dict(gemini_sentiment)} for post in batch]
+        
+        with patch('sentiment.GEMINI_IMPORTED', True), \
+                patch('sentiment.is_gemini_available', return_value=True, create=True), \
+                patch('sentiment.analyze_posts_sentiment_gemini', return_value=None, create=True):
+            client.post('/api/sentiment', json={'posts': posts})
+            assert len(api.sentiment_cache) == 0
+            
+            with patch('sentiment.analyze_posts_sentiment_gemini', side_effect=gemini_ok, create=True):
+                retried = client.post('/api/sentiment', json={'posts': posts}).get_json()
+        
+        assert retried['posts'][0]['sentiment'] == gemini_sentiment
+        assert api.sentiment_cache.get(posts[0]['content']) == gemini_sentiment
+    
+    @pytest.mark.unit
+    def test_clear_reports_removed_entries(self, client):
+        """Clearing should report how many entries were removed"""
+        client.post('/api/cache/clear')
+        posts = [{"id": "1", "content": "Something new to cache"}]
+        client.post('/api/analyze', json={'posts': posts})
+        response = client.post('/api/cache/clear')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['preprocessCleared'] == 1
+        assert data['sentimentCleared'] == 1
+        assert data['responsesCleared'] == 1
+        assert data['geminiCleared'] == 0
+    
+    @pytest.mark.unit
+    def test_identical_analyze_body_served_from_response_cache(self, client):
+        """Repeating an analyze request should replay the cached response"""
+        client.post('/api/cache/clear')
+        posts = [{"id": "1", "content": "Replay this truck analysis"}]
+        first = client.post('/api/analyze', json={'posts': posts})
+        second = client.post('/api/analyze', json={'posts': posts})
+        assert first.headers['ETag'] == second.headers['ETag']
+        assert first.data == second.data
+    
+    @pytest.mark.unit
+    def test_if_none_match_returns_304(self, client):
+        """A matching If-None-Match should short-circuit with 304"""
+        posts = [{"id": "1", "content": "Conditional truck analysis"}]
+        first = client.post('/api/analyze', json={'posts': posts})
+        etag = first.headers['ETag']
+        second = client.post('/api/analyze', json={'posts': posts},
+                             headers={'If-None-Match': etag})
+        assert second.status_code == 304
+        assert second.headers['ETag'] == etag
+    
+    @pytest.mark.unit
+    def test_gzip_replay_has_its_own_etag(self, client):
+        """Gzipped and identity analyze responses should carry different ETags"""
+        client.post('/api/cache/clear')
+        posts = [{"id": str(i), "content": f"Replayed truck analysis {i} " * 20} for i in range(10)]
+        identity = client.post('/api/analyze', json={'posts': posts})
+        gzipped = [client.post('/api/analyze', json={'posts': posts}, headers={'Accept-Encoding': 'gzip'})
+                   for _ in range(2)]
+        assert gzipped[0].headers['Content-Encoding'] == 'gzip'
+        assert gzipped[0].headers['ETag'] == identity.headers['ETag'][:-1] + '-gzip"'
+        assert gzipped[0].data == gzipped[1].data
+        assert gzip.decompress(gzipped[0].data) == identity.data
+        assert 'Accept-Encoding' in identity.headers['Vary']
+
+
+class TestResponseCompression:
+    """Tests for gzip response compression"""
+    
+    @pytest.mark.unit
+    def test_large_response_is_gzipped_when_accepted(self, client):
+        """Large JSON responses should be gzipped for clients that accept it"""
+        posts = [{"id": str(i), "content": f"Great truck number {i} " * 20} for i in range(10)]
         response = client.post('/api/sentiment',
                                json={'posts': posts},
-                               content_type='application/json')
-        data = json.loads(response.data)
-        sentiment = data['posts'][0]['sentiment']
-        assert 'compound' in sentiment
-        assert 'positive' in sentiment
-        assert 'negative' in sentiment
-        assert 'neutral' in sentiment
+                               headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        data = json.loads(gzip.decompress(response.data))
+        assert data['count'] == 10
+    
+    @pytest.mark.unit
+    def test_not_compressed_without_accept_encoding(self, client):
+        """Responses should be plain JSON when the client does not accept gzip"""
+        posts = [{"id": str(i), "content": f"Great truck number {i} " * 20} for i in range(10)]
+        response = client.post('/api/sentiment', json={'posts': posts})
+        assert 'Content-Encoding' not in response.headers
+    
+    @pytest.mark.unit
+    def test_small_response_not_compressed(self, client):
+        """Responses below the size threshold should not be compressed"""
+        response = client.get('/health', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
 
 
 class TestErrorHandling:
@@ -198,7 +327,7 @@ class TestErrorHandling:
         """404 errors should return JSON"""
         response = client.get('/nonexistent')
         assert response.status_code == 404
-        data = json.loads(response.data)
+        data = response.get_json()
         assert 'error' in data
         assert data['error']['code'] == 'NOT_FOUND'
     
@@ -209,14 +338,32 @@ class TestErrorHandling:
                                data='not valid json',
                                content_type='application/json')
         assert response.status_code == 400
+        data = response.get_json()
+        assert data['error']['code'] == 'INVALID_JSON'
+    
+    @pytest.mark.unit
+    @pytest.mark.parametrize('endpoint', ['/api/analyze', '/api/sentiment'])
+    def test_non_json_content_type_returns_415(self, client, endpoint):
+        """Bodies must be sent as application/json"""
+        response = client.post(endpoint, data='{"posts": []}', content_type='text/plain')
+        assert response.status_code == 415
+        assert response.get_json()['error']['code'] == 'UNSUPPORTED_MEDIA_TYPE'
+    
+    @pytest.mark.unit
+    def test_large_integer_ids_are_kept_exact(self, client):
+        """Integer ids beyond 64 bits should not be rounded through a float"""
+        post_id = 123456789012345678901234567890
+        response = client.post('/api/sentiment',
+                               data=f'{{"posts": [{{"id": {post_id}, "content": "Great truck!"}}]}}',
+                               content_type='application/json')
+        assert response.status_code == 200
+        assert b'"id":123456789012345678901234567890' in response.data
     
     @pytest.mark.unit
     def test_error_envelope_structure(self, client):
         """Error responses should have consistent structure"""
-        response = client.post('/api/analyze',
-                               json={},
-                               content_type='application/json')
-        data = json.loads(response.data)
+        response = client.post('/api/analyze', json={})
+        data = response.get_json()
         assert 'error' in data
         assert 'code' in data['error']
         assert 'message' in data['error']
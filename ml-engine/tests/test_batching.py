@@ -0,0 +1,75 @@
+"""
+Tests for request micro-batching
+"""
+import threading
+import time
+import pytest
+from batching import MicroBatcher
+
+
+class TestMicroBatcher:
+    """Tests for MicroBatcher"""
+    
+    @pytest.mark.unit
+    def test_returns_results_in_order(self):
+        """Results should line up with the submitted items"""
+        batcher = MicroBatcher(lambda items: [i * 2 for i in items], max_latency=0)
+        assert batcher.predict([1, 2, 3]) == [2, 4, 6]
+    
+    @pytest.mark.unit
+    def test_empty_input_returns_empty(self):
+        """Empty input should not call the batch function"""
+        batcher = MicroBatcher(lambda items: pytest.fail("should not be called"))
+        assert batcher.predict([]) == []
+    
+    @pytest.mark.unit
+    def test_concurrent_callers_share_batches(self):
+        """Callers arriving while a batch runs should be coalesced and each get their own slice"""
+        calls = []
+        
+        def predict_fn(items):
+            calls.append(len(items))
+            time.sleep(0.05)
+            return [i * 10 for i in items]
+        
+        batcher = MicroBatcher(predict_fn, batch_size=1000, max_latency=0.2)
+        results = {}
+        
+        def worker(n):
+            results[n] = batcher.predict([n, n + 1])
+        
+        threads = [threading.Thread(target=worker, args=(n * 100,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        for n in range(8):
+            assert results[n * 100] == [n * 1000, (n * 100 + 1) * 10]
+        assert sum(calls) == 16
+        assert len(calls) < 8
+    
+    @pytest.mark.unit
+    def test_lone_caller_is_not_delayed(self):
+        """With no batch running, a caller should be flushed without waiting max_latency"""
+        batcher = MicroBatcher(lambda items: items, max_latency=5)
+        start = time.monotonic()
+        assert batcher.predict([1]) == [1]
+        assert time.monotonic() - start < 1
+    
+    @pytest.mark.unit
+    def test_errors_propagate_to_caller(self):
+        """Exceptions from the batch function should be raised to callers"""
+        def predict_fn(items):
+            raise ValueError("boom")
+        
+        batcher = MicroBatcher(predict_fn, max_latency=0)
+        with pytest.raises(ValueError):
+            batcher.predict([1])
+    
+    @pytest.mark.unit
+    def test_result_length_mismatch_raises(self):
+        """A batch function returning the wrong number of results should fail loudly"""
+        batcher = MicroBatcher(lambda items: items[:-1], max_latency=0)
+        with pytest.raises(RuntimeError):
+            batcher.predict([1, 2])
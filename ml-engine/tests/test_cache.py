@@ -0,0 +1,51 @@
+"""
+Tests for content-keyed caching
+"""
+import pytest
+from cache import ContentCache
+
+
+class TestContentCache:
+    """Tests for ContentCache"""
+    
+    @pytest.mark.unit
+    def test_miss_returns_none(self):
+        """Unknown content should return None"""
+        cache = ContentCache(maxsize=10)
+        assert cache.get("never seen") is None
+    
+    @pytest.mark.unit
+    def test_set_then_get(self):
+        """Stored values should be returned for identical content"""
+        cache = ContentCache(maxsize=10)
+        cache.set("Great truck!", {"compound": 0.6})
+        assert cache.get("Great truck!") == {"compound": 0.6}
+        assert cache.get("Great truck") is None
+    
+    @pytest.mark.unit
+    def test_evicts_least_recently_used(self):
+        """Oldest untouched entry should be evicted when full"""
+        cache = ContentCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+    
+    @pytest.mark.unit
+    def test_clear_returns_count(self):
+        """Clearing should empty the cache and report removed entries"""
+        cache = ContentCache(maxsize=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.clear() == 2
+        assert len(cache) == 0
+    
+    @pytest.mark.unit
+    def test_zero_maxsize_disables_cache(self):
+        """maxsize of 0 should store nothing"""
+        cache = ContentCache(maxsize=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
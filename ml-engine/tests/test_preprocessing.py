@@ -1,10 +1,7 @@
 """
 Tests for preprocessing module
 """
-import sys
-import os
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
-
+from unittest.mock import patch
 import pytest
 from preprocessing import clean_text, tokenize, remove_stop_words, preprocess_posts
 
@@ -72,6 +69,14 @@ class TestCleanText:
         second_pass = clean_text(first_pass)
         assert first_pass == second_pass
 
+    @pytest.mark.unit
+    def test_mention_hashtag_edge_cases(self):
+        """URLs are removed before mentions/hashtags; hashtag underscores become spaces"""
+        assert clean_text("see @http://example.com now") == "see now"
+        assert clean_text("#long_haul") == "long haul"
+        assert clean_text("big@rig#deal") == "bigdeal"
+        assert clean_text("wow @#tag") == "wow tag"
+
 
 class TestTokenize:
     """Tests for tokenize function"""
@@ -128,38 +133,67 @@ class TestRemoveStopWords:
         assert "word" in result
 
 
+PREPROCESS_POSTS = [
+    {"id": "url", "content": "Check out https://example.com!"},
+    {"id": "plain", "content": "Great truck performance"},
+    {"id": "fields", "content": "Test", "source": "twitter", "author": "user1"},
+    {"id": "missing"},
+]
+
+
+@pytest.fixture(scope="module")
+def processed():
+    """Preprocess every PREPROCESS_POSTS input in one call, indexed by id"""
+    return {post["id"]: post for post in preprocess_posts(PREPROCESS_POSTS)}
+
+
 class TestPreprocessPosts:
     """Tests for preprocess_posts function"""
     
     @pytest.mark.unit
-    def test_adds_cleaned_content(self):
+    def test_adds_cleaned_content(self, processed):
         """Posts should have cleaned_content field added"""
-        posts = [{"id": "1", "content": "Check out https://example.com!"}]
-        result = preprocess_posts(posts)
-        assert "cleaned_content" in result[0]
-        assert "https" not in result[0]["cleaned_content"]
+        assert "cleaned_content" in processed["url"]
+        assert "https" not in processed["url"]["cleaned_content"]
     
     @pytest.mark.unit
-    def test_adds_tokens(self):
+    def test_adds_tokens(self, processed):
         """Posts should have tokens field added"""
-        posts = [{"id": "1", "content": "Great truck performance"}]
-        result = preprocess_posts(posts)
-        assert "tokens" in result[0]
-        assert isinstance(result[0]["tokens"], list)
+        assert "tokens" in processed["plain"]
+        assert isinstance(processed["plain"]["tokens"], list)
     
     @pytest.mark.unit
-    def test_preserves_original_fields(self):
+    def test_preserves_original_fields(self, processed):
         """Original post fields should be preserved"""
-        posts = [{"id": "1", "content": "Test", "source": "twitter", "author": "user1"}]
-        result = preprocess_posts(posts)
-        assert result[0]["id"] == "1"
-        assert result[0]["source"] == "twitter"
-        assert result[0]["author"] == "user1"
+        assert processed["fields"]["source"] == "twitter"
+        assert processed["fields"]["author"] == "user1"
+    
+    @pytest.mark.unit
+    def test_preserves_order(self, processed):
+        """Results come back in input order"""
+        assert list(processed) == [p["id"] for p in PREPROCESS_POSTS]
     
     @pytest.mark.unit
-    def test_handles_missing_content(self):
+    def test_handles_missing_content(self, processed):
         """Posts without content should be handled gracefully"""
-        posts = [{"id": "1"}]
-        result = preprocess_posts(posts)
-        assert result[0]["cleaned_content"] == ""
-        assert result[0]["tokens"] == []
+        assert processed["missing"]["cleaned_content"] == ""
+        assert processed["missing"]["tokens"] == []
+    
+    @pytest.mark.unit
+    @pytest.mark.slow
+    def test_parallel_matches_serial(self):
+        """Chunked multi-process preprocessing returns the same posts in order"""
+        posts = [
+            {"id": str(i), "content": f"Post {i} about #Peterbilt engine @dealer https://x.co/{i}"}
+            for i in range(25)
+        ]
+        with patch('preprocessing.PARALLEL_PREPROCESS_MIN_POSTS', 10):
+            assert preprocess_posts(posts, n_jobs=2) == preprocess_posts(posts)
+    
+    @pytest.mark.unit
+    def test_large_batches_stay_serial_by_default(self):
+        """Only callers passing n_jobs > 1 start a process pool"""
+        with patch('preprocessing.PARALLEL_PREPROCESS_MIN_POSTS', 1), \
+                patch('preprocessing._preprocess_parallel') as parallel:
+            preprocess_posts(PREPROCESS_POSTS)
+        parallel.assert_not_called()
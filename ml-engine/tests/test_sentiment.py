@@ -1,18 +1,19 @@
 """
 Tests for sentiment analysis module
 """
-import sys
-import os
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
-
+import numpy as np
 import pytest
 from unittest.mock import patch, MagicMock
 from sentiment import (
     analyze_sentiment, 
     _analyze_sentiment_vader,
+    _score_vader_parallel,
     analyze_posts_sentiment,
     aggregate_cluster_sentiment,
-    classify_sentiment
+    classify_sentiment,
+    mean_sentiment_by_group,
+    classify_sentiments,
+    NEUTRAL_SENTIMENT
 )
 
 
@@ -20,36 +21,25 @@ class TestAnalyzeSentimentVader:
     """Tests for VADER sentiment analysis (fallback method)"""
     
     @pytest.mark.unit
-    def test_positive_text(self):
-        """Positive text should have positive compound score"""
-        result = _analyze_sentiment_vader("This truck is amazing and fantastic!")
-        assert result['compound'] > 0
-        assert result['positive'] > result['negative']
-    
-    @pytest.mark.unit
-    def test_negative_text(self):
-        """Negative text should have negative compound score"""
-        result = _analyze_sentiment_vader("This truck is terrible and broken down.")
-        assert result['compound'] < 0
-        assert result['negative'] > result['positive']
-    
-    @pytest.mark.unit
-    def test_neutral_text(self):
-        """Neutral text should have near-zero compound score"""
-        result = _analyze_sentiment_vader("The truck is blue.")
-        assert abs(result['compound']) < 0.5
-    
-    @pytest.mark.unit
-    def test_custom_lexicon_positive(self):
-        """Custom positive terms should be recognized"""
-        result = _analyze_sentiment_vader("This truck has insane torque!")
-        assert result['compound'] > 0
-    
-    @pytest.mark.unit
-    def test_custom_lexicon_negative(self):
-        """Custom negative terms should be recognized"""
-        result = _analyze_sentiment_vader("The truck had a breakdown and derate.")
-        assert result['compound'] < 0
+    @pytest.mark.parametrize('text,sign', [
+        pytest.param("This truck is amazing and fantastic!", 1, id='positive'),
+        pytest.param("This truck is terrible and broken down.", -1, id='negative'),
+        pytest.param("The truck is blue.", 0, id='neutral'),
+        # Custom domain lexicon terms should be recognized
+        pytest.param("This truck has insane torque!", 1, id='custom-lexicon-positive'),
+        pytest.param("The truck had a breakdown and derate.", -1, id='custom-lexicon-negative'),
+    ])
+    def test_compound_sign(self, text, sign):
+        """Compound score should have the expected sign (near zero for neutral text)"""
+        result = _analyze_sentiment_vader(text)
+        if sign > 0:
+            assert result['compound'] > 0
+            assert result['positive'] > result['negative']
+        elif sign < 0:
+            assert result['compound'] < 0
+            assert result['negative'] > result['positive']
+        else:
+            assert abs(result['compound']) < 0.5
     
     @pytest.mark.unit
     def test_returns_all_fields(self):
@@ -65,82 +55,164 @@ class TestAnalyzeSentiment:
     """Tests for main analyze_sentiment function"""
     
     @pytest.mark.unit
-    def test_empty_text_returns_neutral(self):
-        """Empty text should return neutral sentiment"""
-        result = analyze_sentiment("")
-        assert result['compound'] == 0.0
-        assert result['neutral'] == 1.0
-    
-    @pytest.mark.unit
-    def test_whitespace_only_returns_neutral(self):
-        """Whitespace-only text should return neutral sentiment"""
-        result = analyze_sentiment("   ")
-        assert result['compound'] == 0.0
-        assert result['neutral'] == 1.0
-    
-    @pytest.mark.unit
-    def test_none_text_returns_neutral(self):
-        """None text should return neutral sentiment"""
-        result = analyze_sentiment(None)
+    @pytest.mark.parametrize('text', ["", "   ", None], ids=['empty', 'whitespace', 'none'])
+    def test_blank_text_returns_neutral(self, text):
+        """Empty, whitespace-only or None text should return neutral sentiment"""
+        result = analyze_sentiment(text)
         assert result['compound'] == 0.0
         assert result['neutral'] == 1.0
     
     @pytest.mark.unit
     def test_falls_back_to_vader_when_gemini_unavailable(self):
         """Should use VADER when Gemini is not available"""
-        with patch('sentiment.GEMINI_IMPORTED', False):
-            result = analyze_sentiment("Great truck!")
-            assert result is not None
-            assert 'compound' in result
+        assert analyze_sentiment("Great truck!") == _analyze_sentiment_vader("Great truck!")
+
+
+BATCH_POSTS = [
+    {"id": "pos", "content": "Great truck!", "source": "twitter"},
+    {"id": "neg", "content": "Terrible experience.", "author": "user1"},
+    {"id": "empty", "content": ""},
+]
+
+
+@pytest.fixture(scope='module')
+def analyzed_batch():
+    """BATCH_POSTS scored in one analyze_posts_sentiment call, shared by read-only tests"""
+    return analyze_posts_sentiment([dict(p) for p in BATCH_POSTS])
 
 
 class TestAnalyzePostsSentiment:
     """Tests for batch sentiment analysis"""
     
     @pytest.mark.unit
-    def test_adds_sentiment_to_posts(self):
-        """Each post should have sentiment field added"""
+    def test_adds_sentiment_to_posts(self, analyzed_batch):
+        """Each post should have sentiment field added, in input order"""
+        assert [p['id'] for p in analyzed_batch] == [p['id'] for p in BATCH_POSTS]
+        assert all('sentiment' in post for post in analyzed_batch)
+    
+    @pytest.mark.unit
+    def test_scores_follow_content(self, analyzed_batch):
+        """Positive and negative posts should score with the matching sign"""
+        by_id = {p['id']: p for p in analyzed_batch}
+        assert by_id['pos']['sentiment']['compound'] > 0
+        assert by_id['neg']['sentiment']['compound'] < 0
+    
+    @pytest.mark.unit
+    def test_preserves_original_fields(self, analyzed_batch):
+        """Original post fields should be preserved"""
+        by_id = {p['id']: p for p in analyzed_batch}
+        assert by_id['pos']['source'] == "twitter"
+        assert by_id['neg']['author'] == "user1"
+    
+    @pytest.mark.unit
+    def test_handles_empty_content(self, analyzed_batch):
+        """Posts with empty content should get neutral sentiment"""
+        by_id = {p['id']: p for p in analyzed_batch}
+        assert by_id['empty']['sentiment']['compound'] == 0.0
+    
+    @pytest.mark.unit
+    def test_duplicate_content_scored_once(self):
+        """Reposts should be scored once, each getting its own copy of the result"""
+        posts = [{"id": str(i), "content": "Smooth ride, reliable truck"} for i in range(3)]
+        with patch('sentiment._analyze_sentiment_vader', wraps=_analyze_sentiment_vader) as vader:
+            result = analyze_posts_sentiment(posts)
+        assert vader.call_count == 1
+        assert result[0]['sentiment'] == result[2]['sentiment']
+        assert result[0]['sentiment'] is not result[2]['sentiment']
+    
+    @pytest.mark.unit
+    def test_blank_posts_skip_scoring(self):
+        """Empty, whitespace-only and missing content get the neutral score without VADER"""
         posts = [
             {"id": "1", "content": "Great truck!"},
-            {"id": "2", "content": "Terrible experience."}
+            {"id": "2", "content": "   "},
+            {"id": "3"},
+            {"id": "4", "content": None},
         ]
-        result = analyze_posts_sentiment(posts)
-        assert all('sentiment' in post for post in result)
+        with patch('sentiment._analyze_sentiment_vader', wraps=_analyze_sentiment_vader) as vader:
+            result = analyze_posts_sentiment(posts)
+        
+        assert vader.call_count == 1
+        assert [r["id"] for r in result] == ["1", "2", "3", "4"]
+        assert result[0]["sentiment"]["compound"] > 0
+        assert all(r["sentiment"] == NEUTRAL_SENTIMENT for r in result[1:])
     
     @pytest.mark.unit
-    def test_preserves_original_fields(self):
-        """Original post fields should be preserved"""
-        posts = [{"id": "1", "content": "Test", "source": "twitter"}]
-        result = analyze_posts_sentiment(posts)
-        assert result[0]["id"] == "1"
-        assert result[0]["source"] == "twitter"
+    def test_only_uncertain_posts_escalated_to_gemini(self):
+        """Confident VADER scores are kept; weak scores and domain slang go to Gemini"""
+        posts = [
+            {"id": "1", "content": "I love this amazing, wonderful truck!"},
+            {"id": "2", "content": "The truck arrived on Tuesday."},
+            {"id": "3", "content": "This truck is an absolute beast, love it!"},
+        ]
+        gemini_sentiment = {'compound': -0.9, 'positive': 0.0, 'negative': 0.9, 'neutral': 0.1}
+        
+        def fake_gemini(batch, copy=False):
+            return [{**post, 'sentiment': gemini_sentiment} for post in batch]
+        
+        with patch('sentiment.GEMINI_IMPORTED', True), \
+                patch('sentiment.is_gemini_available', return_value=True, create=True), \
+                patch('sentiment.analyze_posts_sentiment_gemini', side_effect=fake_gemini, create=True) as gemini:
+            result = analyze_posts_sentiment(posts)
+        
+        assert [p['id'] for p in gemini.call_args.args[0]] == ["2", "3"]
+        assert result[0]['sentiment']['compound'] > 0.5
+        assert result[1]['sentiment'] == gemini_sentiment
+        assert result[2]['sentiment'] == gemini_sentiment
     
     @pytest.mark.unit
-    def test_handles_empty_content(self):
-        """Posts with empty content should get neutral sentiment"""
-        posts = [{"id": "1", "content": ""}]
-        result = analyze_posts_sentiment(posts)
-        assert result[0]['sentiment']['compound'] == 0.0
+    def test_gemini_failure_keeps_vader_scores(self):
+        """If Gemini fails the VADER scores are returned"""
+        posts = [{"id": "1", "content": "The truck arrived on Tuesday."}]
+        with patch('sentiment.GEMINI_IMPORTED', True), \
+                patch('sentiment.is_gemini_available', return_value=True, create=True), \
+                patch('sentiment.analyze_posts_sentiment_gemini', return_value=None, create=True):
+            result = analyze_posts_sentiment(posts)
+        
+        assert result[0]['sentiment'] == _analyze_sentiment_vader(posts[0]['content'])
+    
+    @pytest.mark.unit
+    def test_annotates_in_place_unless_copy_requested(self):
+        """Posts get 'sentiment' in place by default; copy=True leaves inputs untouched"""
+        posts = [{"id": "1", "content": "Great truck!"}]
+        assert analyze_posts_sentiment(posts)[0] is posts[0]
+        assert 'sentiment' in posts[0]
+        
+        posts = [{"id": "1", "content": "Great truck!"}]
+        result = analyze_posts_sentiment(posts, copy=True)
+        assert 'sentiment' in result[0]
+        assert 'sentiment' not in posts[0]
+    
+    @pytest.mark.unit
+    @pytest.mark.slow
+    def test_parallel_vader_matches_serial(self):
+        """Multi-process VADER scoring keeps order and the custom lexicon"""
+        texts = ["This truck is a beast", "Another breakdown, stranded again", "", "Just a truck"] * 3
+        assert _score_vader_parallel(texts, n_jobs=2) == [_analyze_sentiment_vader(t) for t in texts]
+    
+    @pytest.mark.unit
+    def test_large_batches_stay_serial_by_default(self):
+        """Only callers passing n_jobs > 1 start a process pool"""
+        posts = [{"id": str(i), "content": f"Post {i}"} for i in range(4)]
+        with patch('sentiment.PARALLEL_VADER_MIN_POSTS', 2), \
+                patch('sentiment._score_vader_parallel', wraps=_score_vader_parallel) as parallel:
+            analyze_posts_sentiment(posts, copy=True)
+            parallel.assert_not_called()
+            analyze_posts_sentiment(posts, copy=True, n_jobs=2)
+            parallel.assert_called_once()
 
 
 class TestAggregateClusterSentiment:
     """Tests for cluster sentiment aggregation"""
     
     @pytest.mark.unit
-    def test_calculates_average(self):
-        """Should return average of compound scores"""
-        posts = [
-            {"sentiment": {"compound": 0.5}},
-            {"sentiment": {"compound": 0.3}},
-            {"sentiment": {"compound": 0.2}}
-        ]
-        result = aggregate_cluster_sentiment(posts)
-        assert abs(result - 0.333) < 0.01
-    
-    @pytest.mark.unit
-    def test_empty_posts_returns_zero(self):
-        """Empty posts list should return 0"""
-        assert aggregate_cluster_sentiment([]) == 0.0
+    @pytest.mark.parametrize("n", [0, 1, 3, 100])
+    def test_matches_numpy_mean(self, n):
+        """Should return the mean compound score, or 0 for no posts"""
+        scores = np.random.default_rng(0).uniform(-1, 1, n)
+        posts = [{"sentiment": {"compound": float(s)}} for s in scores]
+        expected = scores.mean() if n else 0.0
+        assert aggregate_cluster_sentiment(posts) == pytest.approx(expected, abs=1e-9)
     
     @pytest.mark.unit
     def test_handles_missing_sentiment(self):
@@ -148,28 +220,55 @@ class TestAggregateClusterSentiment:
         posts = [{"id": "1"}, {"sentiment": {"compound": 0.5}}]
         result = aggregate_cluster_sentiment(posts)
         assert result == 0.25
+    
+    @pytest.mark.unit
+    def test_accepts_generator(self):
+        """Posts can be streamed from a generator"""
+        posts = ({"sentiment": {"compound": c}} for c in (0.5, -0.1, 0.2))
+        assert aggregate_cluster_sentiment(posts) == pytest.approx(0.2)
 
 
 class TestClassifySentiment:
     """Tests for sentiment classification"""
     
     @pytest.mark.unit
-    def test_positive_classification(self):
-        """Scores >= 0.3 should be positive"""
-        assert classify_sentiment(0.3) == "positive"
-        assert classify_sentiment(0.8) == "positive"
-        assert classify_sentiment(1.0) == "positive"
+    def test_classification_thresholds(self):
+        """Scores >= 0.3 are positive, <= -0.3 negative, anything between neutral"""
+        cases = {
+            0.3: "positive", 0.8: "positive", 1.0: "positive",
+            -0.3: "negative", -0.8: "negative", -1.0: "negative",
+            0.0: "neutral", 0.29: "neutral", -0.29: "neutral",
+        }
+        assert {score: classify_sentiment(score) for score in cases} == cases
+
+
+class TestMeanSentimentByGroup:
+    """Tests for vectorized per-group sentiment averaging"""
+    
+    @pytest.mark.unit
+    def test_averages_each_group(self):
+        """Should return the mean score of each group"""
+        result = mean_sentiment_by_group([0, 1, 0, 1], [0.5, -0.4, 0.3, -0.2], n_groups=2)
+        assert result.tolist() == pytest.approx([0.4, -0.3])
     
     @pytest.mark.unit
-    def test_negative_classification(self):
-        """Scores <= -0.3 should be negative"""
-        assert classify_sentiment(-0.3) == "negative"
-        assert classify_sentiment(-0.8) == "negative"
-        assert classify_sentiment(-1.0) == "negative"
+    def test_empty_group_is_zero(self):
+        """Groups with no scores should average to 0"""
+        result = mean_sentiment_by_group([0], [0.5], n_groups=2)
+        assert result.tolist() == [0.5, 0.0]
+    
+    @pytest.mark.unit
+    def test_ignores_out_of_range_ids(self):
+        """Unassigned items (negative or too-large ids) should not affect any group"""
+        result = mean_sentiment_by_group([0, -1, 5], [0.2, 0.9, -0.9], n_groups=1)
+        assert result.tolist() == [0.2]
+
+
+class TestClassifySentiments:
+    """Tests for vectorized sentiment classification"""
     
     @pytest.mark.unit
-    def test_neutral_classification(self):
-        """Scores between -0.3 and 0.3 should be neutral"""
-        assert classify_sentiment(0.0) == "neutral"
-        assert classify_sentiment(0.29) == "neutral"
-        assert classify_sentiment(-0.29) == "neutral"
+    def test_matches_scalar_classification(self):
+        """Array classification should agree with classify_sentiment"""
+        scores = [-1.0, -0.3, -0.29, 0.0, 0.29, 0.3, 1.0]
+        assert classify_sentiments(scores).tolist() == [classify_sentiment(s) for s in scores]
@@ -0,0 +1,248 @@
+"""
+Tests for Gemini sentiment module (Gemini client is faked; no network calls)
+"""
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import textwrap
+from types import SimpleNamespace
+from unittest.mock import patch
+import httpx
+import pytest
+from google.genai import errors
+import sentiment_gemini
+from sentiment_gemini import analyze_posts_sentiment_gemini
+
+
+class FakeAsyncModels:
+    """Stands in for client.aio.models; scores each post by its number"""
+
+    def __init__(self, fail_prompts_containing=None, delay=0.05):
+        self.fail_prompts_containing = fail_prompts_containing
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_content(self, model, contents, config=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail_prompts_containing and self.fail_prompts_containing in contents:
+                raise ValueError("bad request")
+            scores = [int(n) / 100 for n in re.findall(r'post (\d+)', contents)]
+            return SimpleNamespace(text=json.dumps([
+                {'compound': s, 'positive': s, 'negative': 0.0, 'neutral': 1 - s} for s in scores
+            ]))
+        finally:
+            self.in_flight -= 1
+
+
+def fake_client(aio_models):
+    return SimpleNamespace(aio=SimpleNamespace(models=aio_models))
+
+
+@pytest.fixture(autouse=True)
+def empty_gemini_cache():
+    sentiment_gemini.gemini_cache.clear()
+    yield
+    sentiment_gemini.gemini_cache.clear()
+
+
+class TestAnalyzePostsSentimentGemini:
+    """Tests for concurrent batch analysis"""
+
+    @pytest.mark.unit
+    def test_batches_run_concurrently_and_keep_order(self):
+        """All batches should be in flight together and results stay in input order"""
+        models = FakeAsyncModels()
+        posts = [{'id': str(i), 'content': f'post {i}'} for i in range(20)]
+        with patch('sentiment_gemini._init_gemini', return_value=True), \
+                patch('sentiment_gemini._gemini_model', fake_client(models)), \
+                patch('sentiment_gemini.GEMINI_BATCH_SIZE', 5):
+            results = analyze_posts_sentiment_gemini(posts)
+
+        assert [r['id'] for r in results] == [p['id'] for p in posts]
+        assert [r['sentiment']['compound'] for r in results] == [i / 100 for i in range(20)]
+        assert models.max_in_flight == 4
+
+    @pytest.mark.unit
+    def test_failed_batch_falls_back_to_single_post_analysis(self):
+        """A failed batch should be retried post by post"""
+        models = FakeAsyncModels(fail_prompts_containing='post 7')
+        posts = [{'id': str(i), 'content': f'post {i}'} for i in range(10)]
+        single = {'compound': 0.5, 'positive': 0.5, 'negative': 0.0, 'neutral': 0.5}
+        with patch('sentiment_gemini._init_gemini', return_value=True), \
+                patch('sentiment_gemini._gemini_model', fake_client(models)), \
+                patch('sentiment_gemini.analyze_sentiment_gemini', return_value=single) as fallback, \
+                patch('sentiment_gemini.GEMINI_BATCH_SIZE', 5):
+            results = analyze_posts_sentiment_gemini(posts)
+
+        assert fallback.call_count == 5
+        assert [r['id'] for r in results] == [p['id'] for p in posts]
+        assert results[7]['sentiment'] == single
+        assert results[0]['sentiment']['compound'] == 0.0
+
+    @pytest.mark.unit
+    def test_cached_content_is_not_resent(self):
+        """Reposts (including whitespace-only differences) should be served from the cache"""
+        models = FakeAsyncModels()
+        first = [{'id': str(i), 'content': f'post {i}'} for i in range(5)]
+        reposts = [{'id': 'r1', 'content': '  post 3 '}, {'id': 'r2', 'content': 'post 42'}]
+        with patch('sentiment_gemini._init_gemini', return_value=True), \
+                patch('sentiment_gemini._gemini_model', fake_client(models)), \
+                patch.object(models, 'generate_content', wraps=models.generate_content) as generate:
+            analyze_posts_sentiment_gemini(first)
+            results = analyze_posts_sentiment_gemini(reposts)
+
+        assert generate.call_count == 2
+        assert 'post 3' not in generate.call_args.kwargs['contents']
+        assert results[0]['id'] == 'r1'
+        assert results[0]['sentiment']['compound'] == 0.03
+        assert results[1]['sentiment']['compound'] == 0.42
+
+    @pytest.mark.unit
+    def test_duplicate_content_sent_once(self):
+        """Reposts within one call should be scored once and fanned out"""
+        models = FakeAsyncModels()
+        posts = [{'id': str(i), 'content': 'post 9' if i % 2 else 'post 8'} for i in range(6)]
+        with patch('sentiment_gemini._init_gemini', return_value=True), \
+                patch('sentiment_gemini._gemini_model', fake_client(models)), \
+                patch.object(models, 'generate_content', wraps=models.generate_content) as generate:
+            results = analyze_posts_sentiment_gemini(posts)
+
+        assert generate.call_count == 1
+        assert generate.call_args.kwargs['contents'].count('post 8') == 1
+        assert [r['id'] for r in results] == [p['id'] for p in posts]
+        assert [r['sentiment']['compound'] for r in results] == [0.08, 0.09] * 3
+        assert results[0]['sentiment'] is not results[2]['sentiment']
+
+    @pytest.mark.unit
+    def test_returns_none_when_gemini_unavailable(self):
+        """Callers fall back to VADER when Gemini is not configured"""
+        with patch('sentiment_gemini._init_gemini', return_value=False):
+            assert analyze_posts_sentiment_gemini([{'id': '1', 'content': 'x'}]) is None
+
+
+class TestBatchByTokens:
+    """Tests for token-budgeted batching"""
+
+    @pytest.mark.unit
+    def test_short_posts_fill_batches_up_to_post_cap(self):
+        """Short posts are only limited by GEMINI_BATCH_SIZE"""
+        with patch('sentiment_gemini.GEMINI_BATCH_SIZE', 10):
+            batches = sentiment_gemini._batch_by_tokens(list(range(25)), ['short post'] * 25)
+        assert [len(b) for b in batches] == [10, 10, 5]
+        assert [i for b in batches for i in b] == list(range(25))
+
+    @pytest.mark.unit
+    def test_long_posts_split_by_token_budget(self):
+        """Batches stop before exceeding the token budget; an oversized post gets its own batch"""
+        with patch('sentiment_gemini.GEMINI_BATCH_TOKEN_BUDGET', 100), \
+                patch('sentiment_gemini._TOKENS_PER_POST', 0):
+            batches = sentiment_gemini._batch_by_tokens(
+                ['a', 'b', 'c', 'd', 'e'], ['x' * 160, 'x' * 160, 'x' * 1000, 'x' * 40, 'x' * 40]
+            )
+        assert batches == [['a', 'b'], ['c'], ['d', 'e']]
+
+
+class TestRetryDelay:
+    """Tests for retry backoff"""
+
+    @pytest.mark.unit
+    def test_backoff_is_jittered_exponential(self):
+        """Delays grow with the attempt and stay within [base, 2 * base)"""
+        base = sentiment_gemini.GEMINI_RETRY_DELAY_SECONDS
+        for attempt in range(3):
+            delays = {sentiment_gemini._retry_delay(ValueError('503'), attempt) for _ in range(20)}
+            assert all(base * 2 ** attempt <= d < base * 2 ** (attempt + 1) for d in delays)
+            assert len(delays) > 1
+
+    @pytest.mark.unit
+    def test_honors_retry_after_header(self):
+        """A Retry-After header sets the minimum delay"""
+        error = errors.ClientError(429, {}, response=httpx.Response(429, headers={'Retry-After': '7'}))
+        assert sentiment_gemini._retry_delay(error, 0) >= 7
+
+    @pytest.mark.unit
+    def test_honors_retry_info_detail(self):
+        """A google.rpc.RetryInfo detail in the error body sets the minimum delay"""
+        error = errors.ClientError(429, {'error': {'code': 429, 'details': [
+            {'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '12s'}
+        ]}})
+        assert sentiment_gemini._retry_delay(error, 0) >= 12
+
+
+class TestInitGemini:
+    """Tests for Gemini client setup"""
+
+    @pytest.mark.unit
+    def test_client_uses_pooled_httpx_transport(self):
+        """Both clients should share a keep-alive pool sized to the batch concurrency"""
+        with patch.dict(os.environ, {'GEMINI_API_KEY': 'test-key'}), \
+                patch('sentiment_gemini._gemini_available', None), \
+                patch('sentiment_gemini._gemini_model', None):
+            assert sentiment_gemini._init_gemini()
+            api_client = sentiment_gemini._gemini_model._api_client
+
+        assert not api_client._use_aiohttp()
+        for client in (api_client._httpx_client, api_client._async_httpx_client):
+            pool = client._transport._pool
+            assert pool._max_connections == sentiment_gemini.GEMINI_MAX_CONCURRENCY
+            assert pool._keepalive_expiry == sentiment_gemini.GEMINI_KEEPALIVE_SECONDS
+
+
+# Run in a subprocess: gevent's monkey-patching cannot be undone, so it must
+# not leak into the rest of the test session
+_GEVENT_SCRIPT = textwrap.dedent("""
+    from gevent import monkey
+    monkey.patch_all()
+    import sys, time
+    sys.path[:0] = [sys.argv[1], sys.argv[2]]
+    from unittest.mock import patch
+    import gevent
+    import sentiment_gemini
+    from test_sentiment_gemini import FakeAsyncModels, fake_client
+
+    models = FakeAsyncModels(delay=0.2)
+    posts = [{'id': str(i), 'content': f'post {i}'} for i in range(20)]
+    ticks = []
+
+    def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            gevent.sleep(0.02)
+
+    other = gevent.spawn(ticker)
+    with patch('sentiment_gemini._init_gemini', return_value=True), \\
+            patch('sentiment_gemini._gemini_model', fake_client(models)), \\
+            patch('sentiment_gemini.GEMINI_BATCH_SIZE', 5):
+        start = time.monotonic()
+        results = sentiment_gemini.analyze_posts_sentiment_gemini(posts)
+        elapsed = time.monotonic() - start
+    assert [r['sentiment']['compound'] for r in results] == [i / 100 for i in range(20)]
+    assert models.max_in_flight == 4, models.max_in_flight
+    assert elapsed < 0.6, elapsed
+    # The caller blocked cooperatively: other greenlets ran meanwhile
+    assert len(ticks) == 5 and ticks[-1] < start + elapsed, ticks
+""")
+
+
+class TestGeventCompatibility:
+    """Tests for the background event loop under gevent (GUNICORN_WORKER_CLASS=gevent)"""
+
+    @pytest.mark.unit
+    @pytest.mark.slow
+    def test_batches_run_concurrently_after_monkey_patching(self):
+        """The loop thread becomes a greenlet; batches still overlap without blocking the hub"""
+        pytest.importorskip('gevent')
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        app_dir = os.path.join(os.path.dirname(tests_dir), 'app')
+        result = subprocess.run(
+            [sys.executable, '-c', _GEVENT_SCRIPT, app_dir, tests_dir],
+            capture_output=True, text=True, timeout=120
+        )
+        assert result.returncode == 0, result.stderr